@@ -0,0 +1,196 @@
+import os
+from os import path
+from typing import Optional
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+from pydub import AudioSegment
+
+from cacheUtils import file_digest
+
+# bumped whenever the analysis changes, every cached index is made again
+ANALYSIS_VERSION = 3
+SAMPLE_RATE = 22050
+WINDOW = 1024  # samples per analysis frame
+HOP = 512  # samples between analysis frames, about 23 ms
+
+
+def load_samples(song_name: str, frequency: int = SAMPLE_RATE) -> numpy.ndarray:
+    # the whole song as mono floats in [-1, 1], a few minutes are a few megabytes at this rate
+    audio = AudioSegment.from_file(song_name).set_channels(1).set_frame_rate(frequency).set_sample_width(2)
+    return numpy.frombuffer(audio.raw_data, dtype=numpy.int16).astype(numpy.float32) / 32768
+
+
+def frames(samples: numpy.ndarray, window: int = WINDOW, hop: int = HOP) -> numpy.ndarray:
+    # overlapping windows as a view of the samples, nothing is copied
+    if len(samples) < window:
+        samples = numpy.concatenate((samples, numpy.zeros(window - len(samples), dtype=samples.dtype)))
+    count = 1 + (len(samples) - window) // hop
+    stride = samples.strides[0]
+    return as_strided(samples, shape=(count, window), strides=(hop * stride, stride), writeable=False)
+
+
+def sliding_max(values: numpy.ndarray, radius: int) -> numpy.ndarray:
+    padded = numpy.concatenate((numpy.full(radius, -numpy.inf), values, numpy.full(radius, -numpy.inf)))
+    stride = padded.strides[0]
+    return as_strided(padded, shape=(len(values), 2 * radius + 1), strides=(stride, stride),
+                      writeable=False).max(axis=1)
+
+
+def onset_strength(windows: numpy.ndarray) -> numpy.ndarray:
+    # spectral flux: how much louder every frequency got since the previous frame, summed up
+    spectrum = numpy.log1p(100 * numpy.abs(numpy.fft.rfft(windows * numpy.hanning(windows.shape[1]), axis=1)))
+    flux = numpy.maximum(numpy.diff(spectrum, axis=0), 0).sum(axis=1)
+    flux = numpy.concatenate(([0.0], flux))
+    peak = flux.max()
+    return flux / peak if peak > 0 else flux
+
+
+def pick_onsets(strength: numpy.ndarray, radius: int = 3, average: int = 16, delta: float = 0.05) -> numpy.ndarray:
+    # local maxima standing out of the moving average around them
+    kernel = numpy.ones(2 * average + 1) / (2 * average + 1)
+    threshold = numpy.convolve(strength, kernel, mode="same") + delta
+    return numpy.flatnonzero((strength >= sliding_max(strength, radius)) & (strength > threshold))
+
+
+def refine_peak(values: numpy.ndarray, index: int) -> float:
+    # the top of a parabola through the peak and its neighbours, whole frames are too coarse for a tempo
+    if not 0 < index < len(values) - 1:
+        return float(index)
+    before, peak, after = values[index - 1:index + 2]
+    curvature = before - 2 * peak + after
+    return index + 0.5 * (before - after) / curvature if curvature < 0 else float(index)
+
+
+def estimate_tempo(strength: numpy.ndarray, frame_seconds: float, slowest: float = 60.0,
+                   fastest: float = 180.0, octave: float = 0.8) -> float:
+    # The period at which the onset strength repeats best, between the slowest and fastest tempo.
+    # A song that repeats every beat also repeats every two, and the longer lag often peaks a little
+    # higher, so the shortest lag whose peak comes close to the highest one is the beat. The period
+    # is then fitted to the peaks at its multiples across the whole song, to a fraction of a frame.
+    centered = strength - strength.mean()
+    spectrum = numpy.fft.rfft(centered, 2 * len(centered))
+    correlation = numpy.fft.irfft(spectrum * numpy.conj(spectrum))[:len(centered)]
+    # a click smeared over two frames by a period between whole frames still makes one peak
+    correlation = numpy.convolve(correlation, [0.25, 0.5, 0.25], mode="same")
+    shortest = max(1, int(60 / fastest / frame_seconds))
+    longest = min(len(correlation) - 2, int(numpy.ceil(60 / slowest / frame_seconds)))
+    if longest <= shortest:
+        return 120.0
+    lags = numpy.arange(shortest, longest + 1)
+    values = correlation[lags]
+    peaks = (values >= correlation[lags - 1]) & (values >= correlation[lags + 1])
+    if not peaks.any() or values[peaks].max() <= 0:
+        return 120.0
+    lag = int(lags[peaks & (values >= octave * values[peaks].max())][0])
+    period = refine_peak(correlation, lag)
+    multiples = numerators = 0.0
+    for multiple in range(1, 33):
+        guess = int(round(multiple * period))
+        if guess + 2 >= len(correlation) // 2:
+            break
+        index = guess - 1 + int(numpy.argmax(correlation[guess - 1:guess + 2]))
+        numerators += multiple * refine_peak(correlation, index)
+        multiples += multiple * multiple
+        period = numerators / multiples
+    return 60 / (period * frame_seconds)
+
+
+def place_beats(strength: numpy.ndarray, period: float) -> numpy.ndarray:
+    # A grid at the tempo, shifted to where it collects the most onset strength, then every beat
+    # moves to the strongest frame within a quarter period of it so the grid follows small drifts.
+    # The beats are in frames.
+    count = int(len(strength) / period) + 1
+    phases = numpy.arange(max(1, int(period)))
+    positions = numpy.rint(phases[:, None] + numpy.arange(count)[None, :] * period).astype(numpy.intp)
+    inside = positions < len(strength)
+    scores = numpy.where(inside, strength[numpy.minimum(positions, len(strength) - 1)], 0).sum(axis=1)
+    grid = positions[int(numpy.argmax(scores))]
+    radius = max(1, int(period / 4))
+    # no beats in the silence before the music starts or after it ends
+    sounding = numpy.flatnonzero(strength > 0.1)
+    if len(sounding):
+        grid = grid[(grid >= sounding[0] - radius) & (grid <= sounding[-1] + radius)]
+    grid = grid[grid < len(strength)]
+    shifts = numpy.arange(-radius, radius + 1)
+    around = numpy.clip(grid[:, None] + shifts[None, :], 0, len(strength) - 1)
+    # ties, e.g. in silence, keep the beat on the grid
+    preferred = strength[around] - 1e-9 * numpy.abs(shifts)[None, :]
+    return numpy.unique(around[numpy.arange(len(grid)), numpy.argmax(preferred, axis=1)])
+
+
+class TimingIndex:
+    # What the animation needs to know about a song: its tempo, the beat and onset times in
+    # seconds and the loudness of every analysis frame (0-255), saved as one small .npz file.
+    # A frame stands for the middle of its window, not for where the window starts.
+    def __init__(self, frame_seconds: float, tempo: float, beats: numpy.ndarray, onsets: numpy.ndarray,
+                 energy: numpy.ndarray):
+        self.frame_seconds = frame_seconds
+        self.tempo = tempo
+        self.beats = beats
+        self.onsets = onsets
+        self.energy = energy
+
+    @classmethod
+    def analyze(cls, samples: numpy.ndarray, frequency: int = SAMPLE_RATE) -> "TimingIndex":
+        windows = frames(samples)
+        frame_seconds = HOP / frequency
+        strength = onset_strength(windows)
+        tempo = estimate_tempo(strength, frame_seconds)
+        beats = place_beats(strength, 60 / tempo / frame_seconds)
+        loudness = numpy.sqrt(numpy.mean(numpy.square(windows), axis=1))
+        loudest = loudness.max()
+        energy = numpy.rint(255 * loudness / loudest) if loudest > 0 else numpy.zeros(len(loudness))
+        middle = WINDOW / 2 / frequency
+        return cls(frame_seconds, tempo, (beats * frame_seconds + middle).astype(numpy.float32),
+                   (pick_onsets(strength) * frame_seconds + middle).astype(numpy.float32), energy.astype(numpy.uint8))
+
+    @property
+    def beat_period(self) -> float:
+        return 60 / self.tempo
+
+    def next_beat(self, seconds: float) -> float:
+        # the first beat at or after `seconds`, the grid carries on past the analysed ones
+        index = numpy.searchsorted(self.beats, seconds)
+        if index < len(self.beats):
+            return float(self.beats[index])
+        last = float(self.beats[-1]) if len(self.beats) else 0.0
+        return last + max(0, numpy.ceil((seconds - last) / self.beat_period)) * self.beat_period
+
+    def onsets_between(self, start: float, end: float) -> numpy.ndarray:
+        return self.onsets[numpy.searchsorted(self.onsets, start):numpy.searchsorted(self.onsets, end)]
+
+    def energy_at(self, seconds: float) -> float:
+        # the loudness (0-1) of the frame whose window is centred closest to `seconds`
+        index = int(round(seconds / self.frame_seconds - WINDOW / HOP / 2))
+        if not 0 <= index < len(self.energy):
+            return 0.0
+        return self.energy[index] / 255
+
+    def save(self, filename: str):
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as f:
+            numpy.savez_compressed(f, frame_seconds=self.frame_seconds, tempo=self.tempo, beats=self.beats,
+                                   onsets=self.onsets, energy=self.energy)
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename: str) -> "TimingIndex":
+        with numpy.load(filename, allow_pickle=False) as data:
+            return cls(float(data["frame_seconds"]), float(data["tempo"]), data["beats"], data["onsets"],
+                       data["energy"])
+
+
+def timing_index(song_name: str, cache_dir: Optional[str] = path.join(".cache", "timing")) -> TimingIndex:
+    # the analysis runs once per song, later runs load the index by the song's content hash
+    if cache_dir is None:
+        return TimingIndex.analyze(load_samples(song_name))
+    filename = path.join(cache_dir, "{}-{}.npz".format(file_digest(song_name), ANALYSIS_VERSION))
+    try:
+        return TimingIndex.load(filename)
+    except (OSError, ValueError, KeyError):
+        pass
+    index = TimingIndex.analyze(load_samples(song_name))
+    os.makedirs(cache_dir, exist_ok=True)
+    index.save(filename)
+    return index
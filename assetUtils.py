@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+
+class Asset:
+    def __init__(self, loader: "AssetLoader", name: str, future: Future):
+        self.loader = loader
+        self.name = name
+        self.future = future
+
+    def ready(self) -> bool:
+        return self.future.done()
+
+    def get(self):
+        # only the main thread's waits hold up frames, loader threads waiting on each other do not count
+        if not self.future.done() and threading.current_thread() is threading.main_thread():
+            waiting = time.perf_counter()
+            self.future.result()
+            self.loader.waited[self.name] = self.loader.waited.get(self.name, 0.0) + time.perf_counter() - waiting
+        return self.future.result()
+
+
+class AssetLoader:
+    # Images, poems (fonts and line rendering) and audio are loaded side by side on a thread pool,
+    # the main thread only waits for the assets the frame it is about to draw needs.
+    # Every task and every wait is timed so the startup can be broken down afterwards.
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.start = time.perf_counter()
+        self.executor = None
+        self.pid = None
+        self.timings = {}  # type: Dict[str, Tuple[float, float]]
+        self.waited = {}  # type: Dict[str, float]
+        self.marks = []  # type: List[Tuple[str, float]]
+        self.shown = False
+
+    def pool(self) -> ThreadPoolExecutor:
+        # threads do not survive a fork, parallel export workers start a pool of their own
+        if self.pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.pid = os.getpid()
+        return self.executor
+
+    def load(self, name: str, function: Callable, *args, **kwargs) -> Asset:
+        def task():
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.timings[name] = (started, time.perf_counter())
+
+        return Asset(self, name, self.pool().submit(task))
+
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter()))
+
+    def first_frame(self, report: bool = False):
+        # called after every frame, only the first one is marked
+        if not self.shown:
+            self.shown = True
+            self.mark("first frame")
+            if report:
+                print(self.report())
+
+    def report(self) -> str:
+        lines = ["{:<24}{:>10}{:>10}{:>10}".format("startup (ms)", "start", "took", "waited")]
+        events = [(started, "{:<24}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+            name, (started - self.start) * 1000, (finished - started) * 1000, self.waited.get(name, 0.0) * 1000))
+                  for name, (started, finished) in self.timings.items()]
+        events += [(at, "{:<24}{:>10.1f}".format(name, (at - self.start) * 1000)) for name, at in self.marks]
+        lines += [line for _, line in sorted(events)]
+        return "\n".join(lines)
@@ -1,11 +1,125 @@
 from pydub import AudioSegment, effects
+from multiprocessing import Pool
+from os import path
+import argparse
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 
-audio = AudioSegment.from_file("src/沧海一声笑古筝笛子.mp3")
-# effects.speedup(audio[6 * 1000:-16 * 1000], playback_speed=1.10).export("src/卷珠帘琵琶吉他1.10.mp3", format="mp3")
-# effects.speedup(audio[6 * 1000:-16 * 1000], playback_speed=1.15).export("src/卷珠帘琵琶吉他1.15.mp3", format="mp3")
-# effects.speedup(audio[6 * 1000:-16 * 1000], playback_speed=1.20).export("src/卷珠帘琵琶吉他1.20.mp3", format="mp3")
-# effects.speedup(audio, playback_speed=1.25).export("src/卷珠帘琵琶吉他1.25.mp3", format="mp3")
-# effects.speedup(audio, playback_speed=1.30).export("src/卷珠帘琵琶吉他1.30.mp3", format="mp3")
-audio[136 * 1000:204 * 1000].export("src/沧海一声笑剪辑后.mp3", format="mp3")
+# bumped whenever the processing changes, every output is made again
+VERSION = 1
 
+
+def file_hash(filename: str) -> str:
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(filename: str):
+    # {"jobs": [{"source": ..., "output": ..., "start": 6, "end": -16, "speed": 1.1, "format": "mp3"}]}
+    # start and end are in seconds and slice like the segment itself, a negative end counts from the end.
+    # Paths are relative to the manifest.
+    base = path.dirname(path.abspath(filename))
+    with open(filename, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    jobs = []
+    for job in manifest["jobs"]:
+        output = path.normpath(path.join(base, job["output"]))
+        jobs.append({
+            "source": path.normpath(path.join(base, job["source"])),
+            "output": output,
+            "start": job.get("start", 0),
+            "end": job.get("end"),
+            "speed": job.get("speed", 1.0),
+            "format": job.get("format", path.splitext(output)[1][1:] or "mp3"),
+            "bitrate": job.get("bitrate"),
+        })
+    outputs = [job["output"] for job in jobs]
+    duplicates = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicates:
+        raise ValueError("outputs listed more than once: " + ", ".join(duplicates))
+    return jobs
+
+
+def job_key(job, source_hash: str) -> str:
+    parameters = {key: value for key, value in job.items() if key not in ("source", "output")}
+    parameters.update(source=source_hash, version=VERSION)
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def decode(source: str, wav: str):
+    # the only decode of a source, the jobs cutting it read the WAV
+    AudioSegment.from_file(source).export(wav, format="wav")
+
+
+def render(job, wav: str):
+    audio = AudioSegment.from_wav(wav)
+    end = job["end"] * 1000 if job["end"] is not None else None
+    segment = audio[job["start"] * 1000:end]
+    if job["speed"] != 1.0:
+        segment = effects.speedup(segment, playback_speed=job["speed"])
+    os.makedirs(path.dirname(job["output"]), exist_ok=True)
+    segment.export(job["output"], format=job["format"], bitrate=job["bitrate"])
+    return file_hash(job["output"])
+
+
+def up_to_date(job, key: str, cache) -> bool:
+    # the output must still be the file this tool wrote, an edited or missing output is made again
+    entry = cache.get(job["output"])
+    return (entry is not None and entry["key"] == key and path.exists(job["output"]) and
+            file_hash(job["output"]) == entry["hash"])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="cut, speed up and convert soundtracks listed in a manifest")
+    parser.add_argument("manifest", nargs="?", default="audio_cut.json")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--cache", default=path.join(".cache", "audio_cut.json"),
+                        help="where the hashes of the outputs already made are kept")
+    parser.add_argument("--force", action="store_true", help="make every output again")
+    options = parser.parse_args(args)
+
+    jobs = load_manifest(options.manifest)
+    try:
+        with open(options.cache, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    source_hashes = {source: file_hash(source) for source in sorted({job["source"] for job in jobs})}
+    keys = [job_key(job, source_hashes[job["source"]]) for job in jobs]
+    todo = [(job, key) for job, key in zip(jobs, keys) if options.force or not up_to_date(job, key, cache)]
+    print(len(jobs) - len(todo), "of", len(jobs), "outputs are up to date")
+    if not todo:
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="audio-cut-")
+    try:
+        sources = sorted({job["source"] for job, _ in todo})
+        wavs = {source: path.join(work_dir, "{}.wav".format(index)) for index, source in enumerate(sources)}
+        pool = Pool(processes=max(1, options.jobs))
+        try:
+            pool.starmap(decode, [(source, wavs[source]) for source in sources])
+            hashes = pool.starmap(render, [(job, wavs[job["source"]]) for job, _ in todo])
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for (job, key), output_hash in zip(todo, hashes):
+        cache[job["output"]] = {"key": key, "hash": output_hash}
+        print("wrote", job["output"])
+    os.makedirs(path.dirname(path.abspath(options.cache)), exist_ok=True)
+    temporary = options.cache + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1)
+    os.replace(temporary, options.cache)
+
+
+if __name__ == "__main__":
+    main()
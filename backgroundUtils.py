@@ -0,0 +1,140 @@
+import math
+from threading import Lock
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import pygame
+
+from cacheUtils import versions
+
+
+class Motion(NamedTuple):
+    # A slow pan across the background, scaled up by zoom so there is room to move. Over `period`
+    # seconds it goes from one end of the room to the other and back, dx and dy (-1 to 1) are how
+    # much of the room it crosses horizontally and vertically.
+    zoom: float = 1.1
+    dx: float = 1.0
+    dy: float = 0.0
+    period: float = 60.0
+
+
+STEPS = 4  # horizontal subpixel positions of a moving background
+
+# --background-motion, a drift behind the lyrics and a diagonal Ken Burns pan
+MOTIONS = {"parallax": Motion(zoom=1.08, dx=1.0, dy=0.0, period=60.0),
+           "kenburns": Motion(zoom=1.15, dx=0.8, dy=0.6, period=45.0)}
+
+
+def fitted_size(source: Tuple[int, int], size: Tuple[int, int], fit: str, zoom: float) -> Tuple[int, int]:
+    # "cover" keeps the image's proportions and crops what sticks out, "stretch" fills the screen exactly
+    width, height = size
+    if fit == "cover":
+        scale = max(width / source[0], height / source[1])
+        width, height = source[0] * scale, source[1] * scale
+    width, height = math.ceil(width * zoom), math.ceil(height * zoom)
+    if zoom > 1:
+        # a moving image needs one more pixel to blend the next one in
+        width, height = max(width, size[0] + 1), max(height, size[1] + 1)
+    return width, height
+
+
+class Background:
+    # One song's background, decoded once. It is smoothscaled once per output size and kept, the
+    # sizes the display can switch to (window, desktop) are scaled ahead on the asset pool, so F11
+    # or resizing the window never rescales in a frame. A size nobody asked for ahead shows a quick
+    # nearest-neighbour scale for the few frames until its smooth one is ready.
+    # A moving background is painted from the one scaled image at subpixel offsets: horizontally from
+    # copies blended with their neighbouring column a quarter pixel apart, vertically by blending the
+    # next row in with one alpha blit. Nothing is rescaled per frame.
+    def __init__(self, assets, filename: str, size: Tuple[int, int], fit: str = "cover", motion: Motion = None,
+                 sizes: Iterable[Tuple[int, int]] = ()):
+        self.assets = assets
+        self.version = next(versions)
+        self.source = pygame.image.load(filename).convert()
+        self.fit = fit
+        self.motion = motion
+        self.lock = Lock()
+        self.scaled = {size: self.fitted(size)}  # type: Dict[Tuple[int, int], pygame.Surface]
+        self.pending = {}  # size -> Asset being smoothscaled
+        self.stand_ins = {}  # type: Dict[Tuple[int, int], pygame.Surface]
+        self.steps = {}  # size -> the moving image shifted by 0, 1/4, 2/4 and 3/4 of a pixel, made when first shown
+        for other in sizes:
+            self.request(other)
+
+    def fitted(self, size: Tuple[int, int], scale=pygame.transform.smoothscale) -> pygame.Surface:
+        zoom = self.motion.zoom if self.motion is not None else 1.0
+        width, height = fitted_size(self.source.get_size(), size, self.fit, zoom)
+        image = scale(self.source, (width, height))
+        if self.motion is None:
+            # a still background is cut to the screen, so it is blitted and restored as it is
+            image = image.subsurface(pygame.Rect(((width - size[0]) // 2, (height - size[1]) // 2), size)).copy()
+        return image
+
+    def request(self, size: Tuple[int, int]):
+        with self.lock:
+            if size not in self.scaled and size not in self.pending:
+                self.pending[size] = self.assets.load("background {}x{}".format(*size), self.fitted, size)
+
+    def image(self, size: Tuple[int, int]) -> pygame.Surface:
+        image = self.scaled.get(size)
+        if image is not None:
+            return image
+        self.request(size)
+        asset = self.pending[size]
+        if asset.ready():
+            image = self.scaled[size] = asset.get()
+            del self.pending[size]
+            self.stand_ins.pop(size, None)
+            return image
+        if size not in self.stand_ins:
+            self.stand_ins[size] = self.fitted(size, pygame.transform.scale)
+        return self.stand_ins[size]
+
+    def draw(self, renderer, size: Tuple[int, int], seconds: float):
+        image = self.image(size)
+        if self.motion is None:
+            renderer.set_background(image)
+        else:
+            renderer.paint_background(lambda surface: self.paint(surface, image, size, seconds))
+
+    def signature(self, size: Tuple[int, int], seconds: float) -> Optional[tuple]:
+        # what draw() paints, None while a stand-in is up
+        image = self.scaled.get(size)
+        if image is None:
+            return None
+        if self.motion is None:
+            return self.version, size
+        return (self.version, size) + self.position(image, size, seconds)
+
+    def position(self, image: pygame.Surface, size: Tuple[int, int], seconds: float) -> Tuple[int, int, int, int]:
+        # the pixel the screen's corner is on, the quarter pixel step and the alpha of the row below
+        motion = self.motion
+        width, height = size
+        phase = -0.5 * math.cos(2 * math.pi * seconds / motion.period)  # -0.5 to 0.5 and back
+        x = max(0, image.get_width() - width - 1) * (0.5 + motion.dx * phase)
+        y = max(0, image.get_height() - height - 1) * (0.5 + motion.dy * phase)
+        left, top = int(x), int(y)
+        return left, top, int((x - left) * STEPS), round((y - top) * 255)
+
+    def shifted(self, image: pygame.Surface, size: Tuple[int, int], step: int) -> pygame.Surface:
+        # the image moved left by step / STEPS of a pixel, blended once and kept
+        steps = self.steps.setdefault(size, [None] * STEPS)
+        if steps[step] is None or steps[0] is not image:
+            steps[:] = [image] + [None] * (STEPS - 1)
+        if steps[step] is None:
+            blended = image.copy()
+            image.set_alpha(round(step / STEPS * 255))
+            blended.blit(image, (-1, 0))
+            image.set_alpha(None)
+            steps[step] = blended
+        return steps[step]
+
+    def paint(self, surface: pygame.Surface, image: pygame.Surface, size: Tuple[int, int], seconds: float):
+        width, height = size
+        left, top, step, alpha = self.position(image, size, seconds)
+        # horizontally in quarter pixels from the pre-blended images, vertically with one alpha blit
+        shifted = self.shifted(image, size, step)
+        surface.blit(shifted, (0, 0), (left, top, width, height))
+        if alpha:
+            shifted.set_alpha(alpha)
+            surface.blit(shifted, (0, 0), (left, top + 1, width, height))
+            shifted.set_alpha(None)
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from os import path
+
+from exportUtils import parse_size
+
+# Replays fixed scenarios of 十八年 off-screen (SDL's dummy drivers, no display needed) and reports
+# frames per second, how far a frame's allocations raise the heap at their peak and the peak memory of
+# the process, compared with a baseline.
+# Every scenario and resolution runs in a process of its own, so the peak memory is its own as well.
+SCENARIOS = ["lyrics", "code", "snow-0", "snow-10", "snow-36", "kenburns"]
+SIZES = ["1280x720", "1920x1080", "3840x2160"]
+
+
+def prepare(scenario: str, size: str, frames: int):
+    # builds the scene off-screen at the size and returns the function drawing one frame of the scenario
+    from engineUtils import Engine  # pygame only loads in the children
+    from exportUtils import parse_args
+    from sceneUtils import Scene
+    from 十八年 import SONG
+    motion = "kenburns" if scenario == "kenburns" else "none"
+    engine = Engine(parse_args(["--headless", "--size", size, "--line-cache", "", "--background-motion", motion]))
+    scene = Scene(engine.start(), SONG, seed=0)
+    snow = scene.snowflake_background
+    if scenario == "kenburns":
+        # the background alone, composed at a new subpixel offset every frame
+        clock = iter(range(1 << 62))
+        return lambda: scene.background.draw(engine.renderer, engine.size, next(clock) / engine.frame_rate)
+    if scenario == "lyrics":
+        # the middle of the chinese lyrics, where the rows fill the screen
+        snow.active = False
+        scene.seek(max(0, scene.poem("chinese poem").initial_timeline.length // 2 - frames // 2))
+        return scene.update
+    if scenario == "code":
+        # the scroll of the script's own source at the start of the epilogue
+        snow.active = False
+        scene.seek(scene.body_length)
+        return scene.update
+    snow.fall_rate = float(scenario.split("-")[1])
+    # a screen full of snow first, flakes fall at least two pixels a frame
+    for _ in range(engine.height // 2):
+        snow.update(draw=False)
+
+    def frame():
+        scene.background.draw(engine.renderer, engine.size, 0.0)
+        snow.update()
+
+    return frame
+
+
+def run(scenario: str, size: str, frames: int, rounds: int):
+    step = prepare(scenario, size, frames * rounds)
+    step()
+    # the fastest of a few rounds, the slower ones measure whatever else the machine was doing
+    elapsed = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(frames):
+            step()
+        elapsed = min(elapsed, time.perf_counter() - started)
+    # a second, shorter pass under tracemalloc, it slows the frames down too much to time them. Clearing
+    # the traces before every frame also clears the peak, so each frame's peak counts only the blocks
+    # allocated during that frame and still alive at that moment.
+    peaks = 0
+    traced = min(frames, 120)
+    tracemalloc.start()
+    for _ in range(traced):
+        tracemalloc.clear_traces()
+        step()
+        peaks += tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"fps": frames / elapsed, "frame_ms": elapsed / frames * 1000, "peak_delta_kb": peaks / traced / 1024,
+            "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="headless benchmarks of the rendering hot paths")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--sizes", nargs="+", default=SIZES, help="resolutions, e.g. 1920x1080")
+    parser.add_argument("--frames", type=int, default=300, help="frames timed per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per scenario, the fastest one counts")
+    parser.add_argument("--baseline", default="benchmark.json", help="results to compare with")
+    parser.add_argument("--save", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="fraction of the baseline's fps a scenario may lose before it counts as slower")
+    parser.add_argument("--child", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child is not None:
+        print(json.dumps(run(options.child[0], options.child[1], options.frames, options.rounds)))
+        return
+
+    baseline = {}
+    if path.exists(options.baseline):
+        with open(options.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    here = path.dirname(path.abspath(__file__))
+    environment = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    results = {}
+    slower = []
+    print("{:<10}{:>11}{:>9}{:>10}{:>13}{:>9}{:>10}".format("scenario", "size", "fps", "ms/frame", "peak KB/fr",
+                                                            "peak MB", "baseline"))
+    for size in options.sizes:
+        parse_size(size)
+        for scenario in options.scenarios:
+            child = subprocess.run([sys.executable, path.abspath(__file__), "--child", scenario, size,
+                                    "--frames", str(options.frames), "--rounds", str(options.rounds)],
+                                   cwd=here, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if child.returncode != 0:
+                sys.stderr.write(child.stderr.decode("utf-8", "replace"))
+                sys.exit("{} at {} failed".format(scenario, size))
+            # pygame prints its banner to stdout, the result is the last line
+            result = json.loads(child.stdout.decode("utf-8").strip().splitlines()[-1])
+            key = "{}@{}".format(scenario, size)
+            results[key] = result
+            compared = ""
+            if key in baseline:
+                change = result["fps"] / baseline[key]["fps"] - 1
+                compared = "{:+.1%}".format(change)
+                if change < -options.tolerance:
+                    slower.append(key)
+                    compared += " !"
+            print("{:<10}{:>11}{:>9.1f}{:>10.2f}{:>13.1f}{:>9.1f}{:>10}".format(
+                scenario, size, result["fps"], result["frame_ms"], result["peak_delta_kb"], result["peak_mb"], compared))
+
+    if options.save:
+        baseline.update(results)
+        with open(options.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("saved the baseline to", options.baseline)
+    if slower:
+        print("slower than the baseline:", ", ".join(slower))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
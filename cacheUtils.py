@@ -0,0 +1,331 @@
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from os import path
+from threading import Lock
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import pygame
+
+# every poem, background and scene built gets a number of its own, frame cache keys tell them apart by it
+versions = itertools.count()
+
+digests = {}  # (font file, mtime, size) -> content hash
+# FreeType faces may render on several threads at once, but opening them has to be serialized
+font_lock = Lock()
+
+
+def native_format() -> str:
+    # Font surfaces are ARGB words, BGRA bytes on little-endian machines. Lines stored in that
+    # order blit as fast as freshly rendered ones, RGBA surfaces take a far slower conversion path.
+    # BGRA needs pygame 2.1.3, older versions fall back to RGBA.
+    try:
+        pygame.image.frombuffer(bytearray(4), (1, 1), "BGRA")
+    except ValueError:
+        return "RGBA"
+    return "BGRA"
+
+
+PIXEL_FORMAT = native_format()
+
+
+def file_digest(filename: str) -> str:
+    stat = os.stat(filename)
+    memo_key = (path.abspath(filename), stat.st_mtime, stat.st_size)
+    if memo_key not in digests:
+        with open(filename, "rb") as f:
+            digests[memo_key] = hashlib.sha1(f.read()).hexdigest()
+    return digests[memo_key]
+
+
+class LineCache:
+    # Rendered lines are kept as raw 32-bit pixels in one pack file, memory-mapped once on load, so a
+    # cached line becomes a surface without touching the font. lines.index maps every line's
+    # key to [offset, width, height, last used]; when the pack grows past max_bytes it is
+    # rewritten with the most recently used lines only. Every flush maps the pack anew, lines
+    # already handed out keep the mapping they were read from.
+    def __init__(self, directory: Optional[str], max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory or None
+        self.max_bytes = max_bytes
+        self.index = {}  # type: Dict[str, list]
+        self.pending = {}  # type: Dict[str, pygame.Surface]
+        self.pack = None
+        self.dirty = False
+        # poems are built and the cache flushed on the asset pool's threads
+        self.lock = Lock()
+        if self.directory is not None:
+            self.load()
+
+    @property
+    def index_file(self):
+        return path.join(self.directory, "lines.index")
+
+    @property
+    def pack_file(self):
+        return path.join(self.directory, "lines.pack")
+
+    def load(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            pack_size = self.remap()
+        except (OSError, ValueError):
+            self.index = {}
+            self.pack = None
+            return
+        # entries past the end of a truncated pack are lost
+        self.index = {key: entry for key, entry in self.index.items()
+                      if entry[0] + entry[1] * entry[2] * 4 <= pack_size}
+
+    def remap(self) -> int:
+        # maps the pack as it is on disk now and returns its size
+        with open(self.pack_file, "rb") as f:
+            pack_size = os.fstat(f.fileno()).st_size
+            # a private copy-on-write mapping, surfaces made from it may be written to
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if pack_size else None
+        return pack_size
+
+    @staticmethod
+    def key(font_digest: str, font_size: int, bold: bool, text: str, antialias: bool,
+            color: Tuple[int, int, int]) -> str:
+        fields = [PIXEL_FORMAT, font_digest, font_size, bool(bold), bool(antialias), list(color), text]
+        return hashlib.sha1(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[pygame.Surface]:
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            entry = self.index.get(key)
+            if entry is None or self.pack is None:
+                return None
+            offset, width, height, _ = entry
+            entry[3] = time.time()
+            self.dirty = True
+            if width * height == 0:
+                return pygame.Surface((width, height), pygame.SRCALPHA)
+            data = memoryview(self.pack)[offset:offset + width * height * 4]
+        return pygame.image.frombuffer(data, (width, height), PIXEL_FORMAT)
+
+    def put(self, key: str, surface: pygame.Surface):
+        with self.lock:
+            self.pending[key] = surface
+            self.dirty = True
+
+    def entry_data(self, key: str) -> bytes:
+        if key in self.pending:
+            return pygame.image.tostring(self.pending[key], PIXEL_FORMAT)
+        offset, width, height, _ = self.index[key]
+        return self.pack[offset:offset + width * height * 4]
+
+    def flush(self):
+        # Only the process that built the scene should flush, parallel export workers never do.
+        with self.lock:
+            if self.directory is not None and self.dirty:
+                self.write()
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        for key, surface in self.pending.items():
+            width, height = surface.get_size()
+            self.index[key] = [None, width, height, now]
+        total = sum(width * height * 4 for _, width, height, _ in self.index.values())
+        if total > self.max_bytes or self.pack is None:
+            self.rewrite()
+        else:
+            self.append()
+        # the appended lines lie past the end of the old mapping and the rewritten ones have moved
+        self.remap()
+        self.pending = {}
+        self.dirty = False
+        temporary = self.index_file + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temporary, self.index_file)
+
+    def append(self):
+        with open(self.pack_file, "ab") as f:
+            for key in self.pending:
+                self.index[key][0] = f.tell()
+                f.write(self.entry_data(key))
+
+    def rewrite(self):
+        # keep the most recently used lines that fit into max_bytes, least recently used go first
+        kept = {}
+        offset = 0
+        temporary = self.pack_file + ".tmp"
+        with open(temporary, "wb") as f:
+            for key, entry in sorted(self.index.items(), key=lambda item: item[1][3], reverse=True):
+                size = entry[1] * entry[2] * 4
+                if offset + size > self.max_bytes:
+                    continue
+                f.write(self.entry_data(key))
+                kept[key] = [offset, entry[1], entry[2], entry[3]]
+                offset += size
+        try:
+            os.replace(temporary, self.pack_file)
+        except OSError:
+            # the old pack is still mapped (Windows), keep it and evict on a later run
+            os.remove(temporary)
+            self.append()
+            return
+        self.index = kept
+
+    def font(self, filename: str, font_size: int, store: bool = True) -> "CachedFont":
+        return CachedFont(self, filename, font_size, store)
+
+
+class FrameCache:
+    # Whole frames as the scene drew them (before the HUD), keyed by everything that decides what a
+    # frame shows: the section, the background's position, the snow and the offset of the poem on the
+    # screen. A frame with the same key is copied back instead of drawn, e.g. while a poem stays, on the
+    # END card, or when a warm scene, --loop or the R key plays the same frames again. The frame that
+    # is still on the screen is not even copied. Frames are only kept once their key comes up a second
+    # time, and once max_bytes is reached only in place of the least recently shown frame if they came up
+    # more often than it. They are kept in memory, or with a directory in a memory-mapped scratch file.
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, seen_keys: int = 65536):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.seen_keys = seen_keys
+        # key -> [surface or slot in the mapped file, times shown], the least recently shown first
+        self.frames = OrderedDict()
+        self.seen = OrderedDict()  # key -> times drawn, of the frames not kept
+        self.layout = None  # size, pitch and pixel format of the surface the frames are from
+        self.pid = None
+        self.frame_bytes = 0
+        self.file = None
+        self.map = None
+        self.free = []  # type: List[int]
+        self.last = None  # the key of the frame on the screen
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, surface: pygame.Surface):
+        # a resized screen starts the cache afresh, so does a forked export worker, which must not
+        # write into its parent's mapping
+        layout = (surface.get_size(), surface.get_pitch(), surface.get_bitsize(), surface.get_masks())
+        if layout == self.layout and self.pid == os.getpid():
+            return
+        self.layout = layout
+        self.pid = os.getpid()
+        self.frames.clear()
+        self.seen.clear()
+        self.last = None
+        self.frame_bytes = surface.get_pitch() * surface.get_height()
+        if self.directory is not None:
+            if self.map is not None:
+                self.map.close()
+                self.file.close()
+            slots = self.max_bytes // self.frame_bytes
+            self.free = list(range(slots - 1, -1, -1))
+            self.map = None
+            if slots:
+                os.makedirs(self.directory, exist_ok=True)
+                # deleted as soon as it is closed, nothing is left behind for the next run
+                self.file = tempfile.TemporaryFile(dir=self.directory, prefix="frames")
+                self.file.truncate(slots * self.frame_bytes)
+                self.map = mmap.mmap(self.file.fileno(), slots * self.frame_bytes)
+
+    def restore(self, key: Optional[Hashable], surface: pygame.Surface) -> bool:
+        # True once the frame is on the surface, otherwise it has to be drawn and store()d
+        self.check(surface)
+        if key is not None and key == self.last:
+            self.hits += 1
+            return True
+        kept = self.frames.get(key) if key is not None else None
+        if kept is None:
+            self.misses += 1
+            self.last = None
+            return False
+        self.frames.move_to_end(key)
+        kept[1] += 1
+        entry = kept[0]
+        if self.map is None:
+            surface.blit(entry, (0, 0))
+        else:
+            memoryview(surface.get_buffer()).cast("B")[:] = self.slot(entry)
+        self.hits += 1
+        self.last = key
+        return True
+
+    def slot(self, index: int) -> memoryview:
+        return memoryview(self.map)[index * self.frame_bytes:(index + 1) * self.frame_bytes]
+
+    def store(self, key: Optional[Hashable], surface: pygame.Surface):
+        if key is None:
+            return
+        self.last = key
+        drawn = self.seen.pop(key, 0) + 1
+        capacity = self.max_bytes // self.frame_bytes if self.map is None else len(self.frames) + len(self.free)
+        victim = next(iter(self.frames), None)
+        if drawn < 2 or capacity == 0 or (len(self.frames) >= capacity and self.frames[victim][1] >= drawn):
+            # drawn once, or not drawn more often than the frame it would evict: a whole song
+            # played again does not push out the frames that keep coming back
+            self.seen[key] = drawn
+            if len(self.seen) > self.seen_keys:
+                self.seen.popitem(last=False)
+            return
+        if len(self.frames) >= capacity:
+            entry, _ = self.frames.pop(victim)
+            if self.map is not None:
+                self.free.append(entry)
+        if self.map is None:
+            self.frames[key] = [surface.copy(), drawn]
+            return
+        index = self.free.pop()
+        self.slot(index)[:] = memoryview(surface.get_buffer()).cast("B")
+        self.frames[key] = [index, drawn]
+
+    def reset(self):
+        # the screen surface was replaced, e.g. by F11 or a resize: the next check() starts afresh
+        self.layout = None
+
+    def touched(self):
+        # something else was drawn onto the frame on the screen, e.g. the HUD
+        self.last = None
+
+
+class CachedFont:
+    # Stands in for pygame.font.Font. Lines are rendered through the cache and the real
+    # font is only opened once a line is missing from it. Fonts that do not store keep their
+    # misses out of the cache, e.g. rows that are streamed in and dropped again.
+    def __init__(self, cache: LineCache, filename: str, font_size: int, store: bool = True):
+        self.cache = cache
+        self.store = store
+        self.filename = filename
+        self.font_size = font_size
+        self.bold = False
+        self.font = None
+        self.digest = file_digest(filename) if cache.directory is not None else None
+
+    def load(self) -> pygame.font.Font:
+        if self.font is None:
+            with font_lock:
+                font = pygame.font.Font(self.filename, self.font_size)
+            font.set_bold(self.bold)
+            self.font = font
+        return self.font
+
+    def set_bold(self, bold: bool):
+        self.bold = bold
+        if self.font is not None:
+            self.font.set_bold(bold)
+
+    def size(self, text: str) -> Tuple[int, int]:
+        return self.load().size(text)
+
+    def render(self, text: str, antialias: bool, color: Tuple[int, int, int], background=None) -> pygame.Surface:
+        if self.digest is None or background is not None:
+            return self.load().render(text, antialias, color, background)
+        key = self.cache.key(self.digest, self.font_size, self.bold, text, antialias, color)
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = self.load().render(text, antialias, color)
+            if self.store:
+                self.cache.put(key, surface)
+        return surface
@@ -0,0 +1,108 @@
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Tuple
+
+import numpy
+import pygame
+
+LEVELS = 16  # a fading row is drawn at one of this many steps of opacity
+# set on their side in a column like Latin text: brackets, dashes and ellipses
+SIDEWAYS = set("（）()《》〈〉「」『』【】〔〕[]{}<>—–-~～…")
+# sit in the top right corner of their cell in a column instead of the bottom left
+CORNER = set("，。、．")
+
+
+def upright(char: str) -> bool:
+    # CJK characters stand upright in a column, Latin letters and digits lie on their side
+    return unicodedata.east_asian_width(char) in ("W", "F") and char not in SIDEWAYS
+
+
+def column_units(text: str) -> List[Tuple[str, bool]]:
+    # what a column is set in, top to bottom: single upright characters and runs of sideways ones
+    units = []
+    for char in text:
+        standing = upright(char)
+        if not standing and units and not units[-1][1]:
+            units[-1] = (units[-1][0] + char, False)
+        else:
+            units.append((char, standing))
+    return units
+
+
+def column_extent(font, text: str, em: int) -> int:
+    # how far down the column text reaches: an em per upright character, a sideways run its width
+    return sum(em if standing else font.size(unit)[0] for unit, standing in column_units(text))
+
+
+def column(font, text: str, color: Tuple[int, int, int], em: int) -> pygame.Surface:
+    # Sets text top to bottom: upright characters centered in cells an em high, sideways runs turned
+    # clockwise, commas and full stops moved to the top right of their cells. Every glyph is rendered
+    # through the font once, when the row is built.
+    glyphs = []
+    for unit, standing in column_units(text):
+        glyph = font.render(unit, True, color)
+        glyphs.append((glyph if standing else pygame.transform.rotate(glyph, -90), standing, unit in CORNER))
+    width = max([em] + [glyph.get_width() for glyph, _, _ in glyphs])
+    surface = pygame.Surface((width, sum(em if standing else glyph.get_height() for glyph, standing, _ in glyphs)),
+                             pygame.SRCALPHA)
+    y = 0
+    for glyph, standing, corner in glyphs:
+        advance = em if standing else glyph.get_height()
+        x, top = (width - glyph.get_width()) // 2, y + (advance - glyph.get_height()) // 2
+        if corner:
+            x, top = x + em // 2, top - em // 2
+        # BLEND_RGBA_MAX keeps the glyphs' own alpha, as composite_tiles does
+        surface.blit(glyph, (x, top), special_flags=pygame.BLEND_RGBA_MAX)
+        y += advance
+    return surface
+
+
+def box_blur(values: numpy.ndarray, half: int) -> numpy.ndarray:
+    # the mean of the 2 * half + 1 values around each one along the first axis, from running sums
+    window = 2 * half + 1
+    sums = numpy.cumsum(numpy.pad(values, [(half + 1, half)] + [(0, 0)] * (values.ndim - 1)), axis=0)
+    return (sums[window:] - sums[:-window]) / window
+
+
+def glow(surface: pygame.Surface, color: Tuple[int, int, int], radius: int) -> pygame.Surface:
+    # The row over a halo of color: its alpha spread by two box blurs, close to a gaussian one, on
+    # surfarray's alpha array. The result is radius larger on every side.
+    width, height = surface.get_size()
+    halo = pygame.Surface((width + 2 * radius, height + 2 * radius), pygame.SRCALPHA)
+    alpha = numpy.zeros(halo.get_size())
+    alpha[radius:radius + width, radius:radius + height] = pygame.surfarray.array_alpha(surface)
+    half = max(1, radius // 2)
+    for _ in range(2):
+        alpha = box_blur(box_blur(alpha, half).T, half).T
+    halo.fill(color)
+    pixels = pygame.surfarray.pixels_alpha(halo)
+    pixels[:] = numpy.minimum(255, alpha * 2).astype(numpy.uint8)
+    del pixels  # releases the surface lock
+    halo.blit(surface, (radius, radius))
+    return halo
+
+
+def faded(surface: pygame.Surface, level: int) -> pygame.Surface:
+    # a copy at level / LEVELS of the opacity, every pixel's alpha multiplied in one fill
+    copy = surface.copy()
+    copy.fill((255, 255, 255, round(255 * level / LEVELS)), special_flags=pygame.BLEND_RGBA_MULT)
+    return copy
+
+
+class Keyframes:
+    # The surfaces rows are drawn with while an effect changes them, built on first use and kept for
+    # the least recently used to go first: a row fading in steps through each level once instead of
+    # being faded anew every frame, and a still frame draws the very same surfaces again.
+    def __init__(self, capacity: int = 128):
+        self.capacity = capacity
+        self.frames = OrderedDict()
+
+    def get(self, key: Hashable, build: Callable[[], pygame.Surface]) -> pygame.Surface:
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self.frames[key] = build()
+            if len(self.frames) > self.capacity:
+                self.frames.popitem(last=False)
+        else:
+            self.frames.move_to_end(key)
+        return frame
@@ -0,0 +1,291 @@
+import asyncio
+import os
+import platform
+from functools import partial
+from sys import exit
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import pygame
+
+from assetUtils import AssetLoader
+from cacheUtils import FrameCache, LineCache
+from exportUtils import VideoExporter, parse_args, render_parallel
+from profileUtils import FrameProfiler
+from renderUtils import DirtyRectRenderer, FrameRenderer
+from sceneUtils import Scene, Song, flush_line_cache
+from timelineUtils import FrameScheduler, Stage
+
+# the engine of the running export, the parallel export workers are forked with it
+exporting = None  # type: Optional[Engine]
+
+
+# The built-in hotkeys are coroutines: they only change the scene or the display, which belong to the
+# loop, and are done at once. See Engine.hotkey for plain functions.
+async def quit_playing(engine, scene: Scene):
+    # exits from the loop itself, a task would only keep the exit as its result
+    asyncio.get_running_loop().call_soon(engine.quit)
+
+
+async def reinitialize(engine, scene: Scene):
+    scene.current_captions.stage = Stage.REINITIALIZING
+
+
+async def toggle_hud(engine, scene: Scene):
+    engine.profiler.toggle_hud()
+
+
+async def toggle_fullscreen(engine, scene: Scene):
+    engine.toggle_fullscreen()
+
+
+async def freeze(engine, scene: Scene):
+    scene.current_captions.freeze = not scene.current_captions.freeze
+
+
+async def faster(engine, scene: Scene):
+    scene.current_captions.increase_speed()
+
+
+async def slower(engine, scene: Scene):
+    scene.current_captions.decrease_speed()
+
+
+async def more_snow(engine, scene: Scene):
+    if scene.snowflake_background is not None:
+        scene.snowflake_background.increase_snowflakes()
+
+
+async def less_snow(engine, scene: Scene):
+    if scene.snowflake_background is not None:
+        scene.snowflake_background.decrease_snowflakes()
+
+
+async def switch_snow(engine, scene: Scene):
+    if scene.snowflake_background is not None:
+        scene.snowflake_background.switch_visibility()
+
+
+# the hotkeys, by key or by the character typed: '+' needs the shift key at the same time
+KEYS = {pygame.K_q: quit_playing,
+        pygame.K_ESCAPE: quit_playing,
+        pygame.K_r: reinitialize,
+        pygame.K_F3: toggle_hud,
+        pygame.K_F11: toggle_fullscreen,
+        "+": more_snow,
+        pygame.K_MINUS: less_snow,
+        pygame.K_s: switch_snow,
+        pygame.K_p: freeze,
+        pygame.K_UP: faster,
+        pygame.K_DOWN: slower}  # type: Dict[Union[int, str], Callable]
+
+
+class Engine:
+    # Everything songs are played with: the options, the display, the renderer and the caches.
+    # Nothing touches pygame before start(), so importing the engine and the songs is cheap,
+    # and one engine plays any number of songs.
+    def __init__(self, options=None):
+        self.options = options if options is not None else parse_args()
+        self.assets = AssetLoader()
+        self.headless = self.options.export is not None or self.options.headless
+        self.frame_rate = self.options.fps
+        self.speed_unit = 60 / self.frame_rate
+        self.screen = None
+        self.width = self.height = 0
+        self.window_size = None  # the size F11 goes back to from fullscreen
+        self.desktop_size = None
+        self.renderer = None
+        self.line_cache = None
+        self.frame_cache = None
+        self.profiler = None
+        self.fullscreen = False
+        self.keys = dict(KEYS)
+        self.hotkeys = set()  # the hotkey tasks running, the loop only keeps weak references to them
+        self.watcher = None
+        if self.options.watch and not self.headless:
+            from reloadUtils import Watcher
+            self.watcher = Watcher()
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def start(self, window: Optional[Tuple[int, int]] = None) -> "Engine":
+        if self.screen is not None:
+            return self
+        if self.headless:
+            # render to an off-screen surface, no window and no sound device needed
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+        pygame.init()
+        if self.headless:
+            # convert() needs a display mode, the frames themselves never touch it
+            pygame.display.set_mode((1, 1))
+            self.screen = pygame.Surface(self.options.size)
+        else:
+            pygame.mouse.set_cursor((8, 8), (0, 0), (0, 0, 0, 0, 0, 0, 0, 0), (0, 0, 0, 0, 0, 0, 0, 0))
+            # before the first mode is set Info() still describes the desktop
+            info = pygame.display.Info()
+            self.desktop_size = (info.current_w, info.current_h)
+            if platform.system() == "Windows" and window is not None:
+                self.screen = pygame.display.set_mode(window, pygame.RESIZABLE)
+            else:
+                self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+                self.fullscreen = True
+        self.width, self.height = self.screen.get_size()
+        self.window_size = self.size
+        options = self.options
+        self.renderer = (DirtyRectRenderer(self.screen) if options.dirty_rects and not self.headless
+                         else FrameRenderer(self.screen))
+        self.line_cache = LineCache(options.line_cache, options.line_cache_size * 1024 * 1024)
+        # the dirty rect renderer only draws at present() and already skips frames that did not change
+        if options.frame_cache_size > 0 and not isinstance(self.renderer, DirtyRectRenderer):
+            self.frame_cache = FrameCache(options.frame_cache_size * 1024 * 1024, options.frame_cache_dir)
+        # the live loop is always timed for the HUD, an export only when it writes a trace
+        self.profiler = FrameProfiler(enabled=not self.headless, hud=options.hud, trace=options.trace)
+        self.assets.mark("display")
+        return self
+
+    def output_sizes(self):
+        # the sizes the screen can switch to, the backgrounds are scaled to them ahead
+        if self.headless:
+            return []
+        return [size for size in {self.window_size, self.desktop_size} if size is not None and size != self.size]
+
+    def set_mode(self, size: Tuple[int, int], flags: int = 0):
+        self.screen = pygame.display.set_mode(size, flags)
+        self.width, self.height = self.screen.get_size()
+        self.renderer.set_surface(self.screen)
+        if self.frame_cache is not None:
+            # the new surface shows none of the frames kept, even at the same size
+            self.frame_cache.reset()
+
+    def toggle_fullscreen(self):
+        if self.fullscreen:
+            self.set_mode(self.window_size, pygame.RESIZABLE if platform.system() == "Windows" else 0)
+        else:
+            self.window_size = self.size
+            self.set_mode((0, 0), pygame.FULLSCREEN)
+        self.fullscreen = not self.fullscreen
+
+    def resize(self, size: Tuple[int, int]):
+        # the background follows the window at once, the poems keep the layout they were built with
+        if not self.fullscreen and size != self.size:
+            self.window_size = size
+            self.set_mode(size, pygame.RESIZABLE)
+
+    def quit(self):
+        pygame.quit()
+        exit(0)
+
+    def handle(self, event, scene: Scene):
+        if event.type == pygame.QUIT:
+            self.quit()
+        if event.type == pygame.VIDEORESIZE:
+            self.resize(event.size)
+        if event.type != pygame.KEYDOWN:
+            return
+        action = self.keys.get(event.key) or self.keys.get(event.unicode)
+        if action is None:
+            return
+        task = asyncio.ensure_future(self.hotkey(action, scene))
+        self.hotkeys.add(task)
+        task.add_done_callback(self.hotkeys.discard)
+
+    async def hotkey(self, action: Callable, scene: Scene):
+        # Hotkeys run as tasks on the loop, between two frames. A coroutine changes the scene on the loop
+        # and awaits its slow parts, e.g. in the loop's executor. A plain function runs in the executor
+        # itself, so however long it takes no frame waits for it. It must not touch the scene or the
+        # display there: what it returns, if it is callable, is called on the loop to apply its result.
+        if asyncio.iscoroutinefunction(action):
+            await action(self, scene)
+            return
+        apply = await asyncio.get_running_loop().run_in_executor(None, action, self, scene)
+        if callable(apply):
+            apply()
+
+    def particles(self, scene: Scene) -> Optional[int]:
+        return len(scene.snowflake_background) if scene.snowflake_background is not None else None
+
+    async def play(self, scene: Scene, music, playing: Callable[[], bool]):
+        # the render task: plays the scene to its music for as long as playing() says so, it is asked
+        # every frame. The music is fed, the next song prefetched and the control socket served by
+        # other tasks on the same loop while it waits for the next frame.
+        assets, profiler = self.assets, self.profiler
+        # the animation follows the song's playback position instead of counting frames, frames the
+        # machine is too slow to draw are skipped so the lyrics stay with the music
+        scheduler = FrameScheduler(self.frame_rate, music.position)
+        with music:
+            while playing():
+                with profiler.section("events"):
+                    for event in pygame.event.get():
+                        self.handle(event, scene)
+                if self.watcher is not None:
+                    with profiler.section("reload"):
+                        self.watcher.poll(scene)
+                frames = scheduler.due()
+                for _ in range(frames - 1):
+                    scene.update(draw=False)
+                if frames:
+                    scene.update()
+                    profiler.hud(self.renderer)
+                    if self.frame_cache is not None and profiler.show_hud:
+                        self.frame_cache.touched()
+                    with profiler.section("present"):
+                        self.renderer.present()
+                    assets.first_frame(self.options.startup_report)
+                    profiler.end_frame(self.particles(scene), skipped=frames - 1)
+                await scheduler.wait()
+
+    def export(self, song: Song, output: str):
+        global exporting
+        self.start(song.window)
+        options = self.options
+        audio = options.audio or song.music
+        if options.jobs > 1:
+            total_frames = Scene(self, song, options.end_time, options.seed).length
+            self.line_cache.flush()
+            exporting = self
+            render_parallel(partial(render_chunk, song), total_frames, options.jobs, output, audio=audio,
+                            ffmpeg=options.ffmpeg)
+            print("exported", total_frames, "frames to", output, "with", options.jobs, "workers")
+            return
+        scene = Scene(self, song, options.end_time, options.seed)
+        self.assets.load("line cache", flush_line_cache, scene)
+        with VideoExporter(output, self.size, self.frame_rate, audio=audio, ffmpeg=options.ffmpeg,
+                           crf=options.crf, preset=options.preset) as exporter:
+            while not scene.completed:
+                scene.update()
+                with self.profiler.section("write"):
+                    exporter.write(self.screen)
+                self.assets.first_frame(options.startup_report)
+                self.profiler.end_frame(self.particles(scene))
+        print("exported", exporter.frames_written, "frames to", output)
+
+
+def render_chunk(song: Song, start: int, stop: int, output: str):
+    # a worker that was spawned instead of forked starts an engine of its own from the same arguments
+    engine = exporting if exporting is not None else Engine().start(song.window)
+    options = engine.options
+    scene = Scene(engine, song, options.end_time, options.seed)
+    scene.seek(start)
+    with VideoExporter(output, engine.size, engine.frame_rate, ffmpeg=options.ffmpeg, crf=options.crf,
+                       preset=options.preset) as exporter:
+        for _ in range(start, stop):
+            scene.update()
+            exporter.write(engine.screen)
+
+
+def main(*songs: Song):
+    # plays the songs one after the other on one engine, the last one stays on its END card
+    engine = Engine()
+    options = engine.options
+    if engine.headless:
+        if options.export is not None:
+            if len(songs) != 1:
+                exit("--export takes one song")
+            engine.export(songs[0], options.export)
+        exit(0)
+    from playlistUtils import Playlist  # pydub and the mixer only load once a song plays
+    playlist = Playlist(engine, songs, loop=options.loop, warm=options.warm_songs, control=options.control)
+    asyncio.run(playlist.run())
+    engine.quit()  # the quit command ends the playlist
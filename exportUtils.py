@@ -0,0 +1,168 @@
+import argparse
+import shutil
+import subprocess
+import tempfile
+from multiprocessing import Pool
+from os import path
+from typing import Callable, List, Optional, Tuple
+
+import pygame
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("songs", nargs="*", help="the song modules play.py plays one after the other, e.g. 十八年")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw and present the parts of the screen that changed")
+    parser.add_argument("--export", metavar="OUTPUT", default=None,
+                        help="render off-screen as fast as possible into a video file (.raw writes bare RGB frames)")
+    parser.add_argument("--headless", action="store_true",
+                        help="render off-screen without a window or sound device, as an export does")
+    parser.add_argument("--size", type=parse_size, default=(1920, 1080), help="off-screen resolution, e.g. 3840x2160")
+    parser.add_argument("--fps", type=int, default=60,
+                        help="frame rate of the animation, e.g. 144 for smoother motion on a fast display")
+    parser.add_argument("--audio", default=None, help="soundtrack muxed into the export, defaults to the song's")
+    parser.add_argument("--end-time", type=float, default=3.0, help="seconds the END card stays in the export")
+    parser.add_argument("--jobs", type=int, default=1, help="render the export in this many worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random parts of the scene, e.g. snow")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable used for encoding")
+    parser.add_argument("--crf", type=int, default=18)
+    parser.add_argument("--preset", default="veryfast")
+    parser.add_argument("--line-cache", default=path.join(".cache", "lines"),
+                        help="directory of the on-disk cache of rendered lines, empty to disable")
+    parser.add_argument("--line-cache-size", type=int, default=256, help="line cache budget in megabytes")
+    parser.add_argument("--audio-cache-size", type=int, default=1024,
+                        help="megabytes of decoded songs kept in .cache/audio, the least recently played go first")
+    parser.add_argument("--frame-cache-size", type=int, default=0,
+                        help="megabytes of whole frames kept to be shown again without drawing them, 0 turns it off")
+    parser.add_argument("--frame-cache-dir", default="",
+                        help="keep the cached frames in a memory-mapped scratch file here instead of in memory")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print where the time to the first frame went")
+    parser.add_argument("--hud", action="store_true",
+                        help="show fps, p50/p99 frame times, particles and the time of every part (F3 toggles)")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write every frame's timings in Chrome's trace event format (chrome://tracing)")
+    parser.add_argument("--follow-beats", action="store_true",
+                        help="pace the lyrics by the song's beats, the analysis is cached in .cache/timing")
+    parser.add_argument("--beats-per-row", type=float, default=1.0, help="beats between two rows with --follow-beats")
+    parser.add_argument("--background-motion", choices=["none", "parallax", "kenburns"], default=None,
+                        help="pan slowly across the background, drifting sideways or Ken Burns style "
+                             "(defaults to the song's own)")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload lyric files and the song's own file when they change, without restarting")
+    parser.add_argument("--loop", action="store_true", help="play the songs over and over")
+    parser.add_argument("--warm-songs", type=int, default=2,
+                        help="songs whose fonts and rendered lines stay loaded between plays")
+    parser.add_argument("--control", metavar="SOCKET", default=None,
+                        help="Unix socket (or a localhost TCP port) taking queue/next NAME, skip, pause, resume, "
+                             "status and quit")
+    parser.add_argument("--send", metavar="COMMAND", default=None,
+                        help="send a command to the instance listening on --control and print its answer")
+    return parser.parse_known_args(args)[0]
+
+
+class VideoExporter:
+    def __init__(self, output: str, size: Tuple[int, int], frame_rate: int, audio: Optional[str] = None,
+                 ffmpeg: str = "ffmpeg", crf: int = 18, preset: str = "veryfast"):
+        self.output = output
+        self.size = size
+        self.frame_rate = frame_rate
+        self.audio = audio
+        self.ffmpeg = ffmpeg
+        self.crf = crf
+        self.preset = preset
+        self.raw = path.splitext(output)[1].lower() == ".raw"
+        self.process = None
+        self.sink = None
+        self.frames_written = 0
+
+    def command(self):
+        width, height = self.size
+        command = [self.ffmpeg, "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height),
+                   "-r", str(self.frame_rate), "-i", "-"]
+        if self.audio is not None:
+            # the video ends with the frames rendered, a longer song would hold the last one until it ends
+            command += ["-i", self.audio, "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-b:a", "192k", "-shortest"]
+        command += ["-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf), "-pix_fmt", "yuv420p",
+                    self.output]
+        return command
+
+    def open(self):
+        if self.raw:
+            self.sink = open(self.output, "wb")
+        else:
+            self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE)
+            self.sink = self.process.stdin
+        return self
+
+    def write(self, surface: pygame.Surface):
+        assert surface.get_size() == self.size
+        self.sink.write(pygame.image.tostring(surface, "RGB"))
+        self.frames_written += 1
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        if self.process is not None:
+            return_code = self.process.wait()
+            self.process = None
+            if return_code != 0:
+                raise RuntimeError("ffmpeg exited with code {} while writing {}".format(return_code, self.output))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def split_frames(total_frames: int, parts: int) -> List[Tuple[int, int]]:
+    step = max(1, -(-total_frames // parts))
+    return [(start, min(start + step, total_frames)) for start in range(0, total_frames, step)]
+
+
+def concat_chunks(chunks: List[str], output: str, audio: Optional[str] = None, ffmpeg: str = "ffmpeg"):
+    if path.splitext(output)[1].lower() == ".raw":
+        with open(output, "wb") as joined:
+            for chunk in chunks:
+                with open(chunk, "rb") as f:
+                    shutil.copyfileobj(f, joined)
+        return
+    list_file = path.join(path.dirname(chunks[0]), "chunks.txt")
+    with open(list_file, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write("file '{}'\n".format(chunk.replace("'", "'\\''")))
+    command = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file]
+    if audio is not None:
+        command += ["-i", audio, "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-b:a", "192k", "-shortest"]
+    command += ["-c:v", "copy", output]
+    subprocess.run(command, check=True)
+
+
+def render_parallel(render_chunk: Callable[[int, int, str], None], total_frames: int, jobs: int, output: str,
+                    audio: Optional[str] = None, ffmpeg: str = "ffmpeg"):
+    # render_chunk(start, stop, chunk_path) must rebuild the scene at `start` on its own,
+    # it runs in a separate process
+    extension = ".raw" if path.splitext(output)[1].lower() == ".raw" else ".mp4"
+    work_dir = tempfile.mkdtemp(prefix="poem-export-")
+    try:
+        tasks = [(start, stop, path.join(work_dir, "chunk-{:04d}{}".format(index, extension)))
+                 for index, (start, stop) in enumerate(split_frames(total_frames, jobs))]
+        # workers are closed and joined instead of terminated, SDL turns SIGTERM into a quit event
+        pool = Pool(processes=jobs)
+        try:
+            pool.starmap(render_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        concat_chunks([chunk for _, _, chunk in tasks], output, audio=audio, ffmpeg=ffmpeg)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,157 @@
+import bisect
+import itertools
+import math
+import re
+from os import path
+from typing import List, NamedTuple, Optional, Tuple
+
+from timelineUtils import PoemState, Stage, frames_to_pass
+
+LRC_STAMP = re.compile(r"\[(\d+):(\d+(?:[.:]\d+)?)\]")
+LRC_OFFSET = re.compile(r"\[offset:\s*([+-]?\d+)\s*\]", re.IGNORECASE)
+SRT_TIMING = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)")
+SRT_TAG = re.compile(r"<[^>]*>|\{\\[^}]*\}")
+
+
+class Cue(NamedTuple):
+    start: float  # seconds into the song
+    end: float
+    lines: Tuple[str, ...]  # the text, one line per language in a bilingual track
+
+
+def parse_lrc(text: str, hold: float = 10.0) -> List[Cue]:
+    # "[01:02.50]text", a line may carry several stamps (a chorus sung again) and lines with the same
+    # stamp are one cue, e.g. the original and its translation. A cue lasts until the next one starts,
+    # the last one for `hold` seconds. [offset:+500] makes every stamp 500 ms earlier, as players do.
+    offset = 0.0
+    stamped = {}  # start -> lines
+    for line in text.splitlines():
+        line = line.strip()
+        match = LRC_OFFSET.fullmatch(line)
+        if match:
+            offset = int(match.group(1)) / 1000
+            continue
+        starts = []
+        match = LRC_STAMP.match(line)
+        while match:
+            starts.append(int(match.group(1)) * 60 + float(match.group(2).replace(":", ".")))
+            line = line[match.end():]
+            match = LRC_STAMP.match(line)
+        for start in starts:
+            stamped.setdefault(start, []).append(line.strip())
+    starts = sorted(stamped)
+    ends = starts[1:] + [starts[-1] + hold] if starts else []
+    return [Cue(max(0.0, round(start - offset, 3)), max(0.0, round(end - offset, 3)), tuple(stamped[start]))
+            for start, end in zip(starts, ends)]
+
+
+def parse_srt(text: str, bilingual: bool = False) -> List[Cue]:
+    # numbered blocks: "hh:mm:ss,mmm --> hh:mm:ss,mmm" and the text below it, the styling tags dropped.
+    # A subtitle wrapped over several lines is one row, unless the track is bilingual: then each line is
+    # a language of its own.
+    def seconds(hours, minutes, whole, fraction):
+        return int(hours) * 3600 + int(minutes) * 60 + int(whole) + int(fraction) / 10 ** len(fraction)
+
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").strip()):
+        lines = block.split("\n")
+        for index, line in enumerate(lines):
+            match = SRT_TIMING.search(line)
+            if match:
+                fields = match.groups()
+                texts = tuple(SRT_TAG.sub("", text).strip() for text in lines[index + 1:])
+                cues.append(Cue(seconds(*fields[:4]), seconds(*fields[4:]),
+                                texts if bilingual else (" ".join(text for text in texts if text),)))
+                break
+    return sorted(cues, key=lambda cue: cue.start)
+
+
+def load_cues(filename: str, hold: float = 10.0, bilingual: bool = False) -> Optional[List[Cue]]:
+    # the cues of a timed lyric file, None for a plain text file
+    extension = path.splitext(filename)[1].lower()
+    if extension not in (".lrc", ".srt"):
+        return None
+    with open(filename, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    return parse_lrc(text, hold) if extension == ".lrc" else parse_srt(text, bilingual)
+
+
+class CueIndex:
+    # The cues sorted by their start, with the running maximum of their ends. Both lists are sorted,
+    # so the cue a moment falls into is one bisection of the starts, and the cues showing at a moment
+    # (subtitles may overlap) lie between two bisections: every cue before the first running end past
+    # the moment has ended, no cue from the first start past it has begun. Each takes O(log n) per frame.
+    def __init__(self, cues: List[Cue]):
+        self.cues = sorted(cues, key=lambda cue: cue.start)
+        self.starts = [cue.start for cue in self.cues]
+        self.latest_ends = list(itertools.accumulate((cue.end for cue in self.cues), max))
+
+    def __len__(self):
+        return len(self.cues)
+
+    def showing(self, seconds: float) -> Tuple[int, ...]:
+        # the indices of the cues showing at `seconds`, none in a gap between two of them
+        first = bisect.bisect_right(self.latest_ends, seconds)
+        last = bisect.bisect_right(self.starts, seconds)
+        return tuple(index for index in range(first, last) if self.cues[index].end > seconds)
+
+    def position(self, seconds: float) -> float:
+        # how many rows the lyrics have moved on from the first cue: cue i is at i when it starts
+        # and the rows move on steadily until the next cue starts
+        index = max(0, bisect.bisect_right(self.starts, seconds) - 1)
+        if index + 1 >= len(self.starts):
+            return float(index)
+        start, following = self.starts[index], self.starts[index + 1]
+        if following <= start:
+            return float(index)
+        return index + min(1.0, max(0.0, (seconds - start) / (following - start)))
+
+
+class CueTimeline:
+    # The timeline of a poem read from a timed lyric file, what PoemTimeline is to a plain one: the row
+    # of each cue reaches the reading line when its cue starts. Before the first cue the rows rise at
+    # the poem's speed, after the last one has ended they leave at its leaving speed. start_time is
+    # the second of the song at which the poem starts playing, its frames count from there.
+    def __init__(self, cues: CueIndex, frame_rate: int, reading_offset: float, line_space: float,
+                 speed: float, leaving_speed: float, leaving_threshold: float, start_time: float = 0.0):
+        self.cues = cues
+        self.frame_rate = frame_rate
+        self.reading_offset = reading_offset  # the offset at which the first row is on the reading line
+        self.line_space = line_space
+        self.speed = speed
+        self.leaving_speed = leaving_speed
+        self.leaving_threshold = leaving_threshold
+        self.start_time = start_time
+        self.start_frame = 0
+        self.first_frame = (cues.starts[0] - start_time) * frame_rate
+        last = cues.cues[-1]
+        self.last_offset = reading_offset + (len(cues) - 1) * line_space
+        self.leaving_frame = max(0, math.ceil((max(last.start, last.end) - start_time) * frame_rate))
+        self.leaving_frames = frames_to_pass(self.last_offset, leaving_speed, leaving_threshold)
+        self.length = self.leaving_frame + self.leaving_frames
+
+    def starting_at(self, start_time: float) -> "CueTimeline":
+        return CueTimeline(self.cues, self.frame_rate, self.reading_offset, self.line_space, self.speed,
+                           self.leaving_speed, self.leaving_threshold, start_time)
+
+    def state(self, frame: int) -> PoemState:
+        if frame >= self.length:
+            return PoemState(Stage.COMPLETED, self.last_offset + self.leaving_frames * self.leaving_speed, 0.0,
+                             self.leaving_speed)
+        if frame >= self.leaving_frame:
+            return PoemState(Stage.LEAVING, self.last_offset + (frame - self.leaving_frame) * self.leaving_speed,
+                             0.0, self.leaving_speed)
+        if frame < self.first_frame:
+            offset = max(0.0, self.reading_offset - (self.first_frame - frame) * self.speed)
+            return PoemState(Stage.ENTERING, offset, 0.0, self.speed)
+        # the rows keep to the song's clock while the cues run, freezing them would lose the song
+        seconds = self.start_time + frame / self.frame_rate
+        return PoemState(Stage.STAYING, self.reading_offset + self.cues.position(seconds) * self.line_space, 0.0,
+                         self.speed)
+
+    def showing(self, frame: int) -> Tuple[int, ...]:
+        return self.cues.showing(self.start_time + frame / self.frame_rate)
+
+    def rebase(self, frame: int, speed: float) -> "CueTimeline":
+        # the cues set the pace, the speed hotkeys leave a timed poem as it is
+        return self
@@ -1,50 +1,368 @@
-from threading import Thread
+from threading import Event, Lock
+import asyncio
+import hashlib
+import itertools
+import os
 import platform
+import subprocess
+import tempfile
+from os import path
 
 if platform.system() == "Linux":
     from pydub import AudioSegment
-    from pydub.playback import play
-from time import sleep
+from time import perf_counter
 from pygame import mixer  # Load the popular external library
+import pygame
 
 
-class LoopMusic(Thread):
-    def __init__(self, music, loops=1, interval=3):
-        super(LoopMusic, self).__init__()
-        self.audio = music
-        self.interval = interval
+class PlaybackClock:
+    # Seconds of audio played so far. It is anchored whenever a chunk is known to start playing and
+    # carried on with the wall clock in between, so it keeps running after the last chunk as well.
+    def __init__(self):
+        self.anchor = None  # (perf_counter() when a chunk started, seconds of audio before that chunk)
+        self.paused_at = None
+
+    def start_chunk(self, seconds_before: float):
+        self.anchor = (perf_counter(), seconds_before)
+
+    def position(self) -> float:
+        if self.anchor is None:
+            return 0.0
+        if self.paused_at is not None:
+            return self.paused_at
+        started, seconds_before = self.anchor
+        return seconds_before + perf_counter() - started
+
+    def pause_clock(self):
+        if self.paused_at is None:
+            self.paused_at = self.position()
+
+    def resume_clock(self):
+        if self.paused_at is not None:
+            self.anchor = (perf_counter(), self.paused_at)
+            self.paused_at = None
+
+
+class MixerSink(PlaybackClock):
+    # Plays PCM chunks back to back on one mixer channel. The channel holds the chunk that is
+    # playing and one queued behind it, write() waits on the event loop until there is room for the next.
+    # The moment the queued chunk takes over corrects the clock, so it cannot drift from the device.
+    def __init__(self):
+        super(MixerSink, self).__init__()
+        if not mixer.get_init():
+            mixer.init()
+        self.frequency, size, self.channels = mixer.get_init()
+        self.bytes_per_second = 2 * self.channels * self.frequency
+        self.channel = None
+        self.written = 0
+        self.queued_at = None  # where the chunk waiting in the queue starts, in seconds
+        self.stopped = False
+
+    async def write(self, chunk: bytes):
+        if self.stopped:
+            return
+        sound = mixer.Sound(buffer=chunk)
+        starts_at = self.written / self.bytes_per_second
+        self.written += len(chunk)
+        if self.channel is None or not self.channel.get_busy():
+            # the first chunk, or the queue ran dry: the chunk plays right away
+            if self.channel is None:
+                self.channel = sound.play()
+            else:
+                self.channel.play(sound)
+            self.start_chunk(starts_at)
+            self.queued_at = None
+            return
+        while self.channel.get_queue() is not None and not self.stopped:
+            await asyncio.sleep(0.005)
+        if self.stopped:
+            return
+        if self.queued_at is not None:
+            self.start_chunk(self.queued_at)
+        self.channel.queue(sound)
+        self.queued_at = starts_at
+
+    def pause(self):
+        self.pause_clock()
+        if self.channel is not None:
+            self.channel.pause()
+
+    def resume(self):
+        if self.channel is not None:
+            self.channel.unpause()
+        self.resume_clock()
+
+    def stop(self):
+        self.stopped = True
+        if self.channel is not None and mixer.get_init():
+            self.channel.stop()
+
+
+class NullSink(PlaybackClock):
+    # Stands in for a sound device that is not there, it takes the PCM at the pace it would be played.
+    def __init__(self, frequency=44100, channels=2):
+        super(NullSink, self).__init__()
+        self.frequency = frequency
+        self.channels = channels
+        self.bytes_per_second = 2 * channels * frequency
+        self.written = 0
+        self.stopped = False
+
+    async def write(self, chunk: bytes):
+        if not self.stopped:
+            self.start_chunk(self.written / self.bytes_per_second)
+            self.written += len(chunk)
+            await asyncio.sleep(len(chunk) / self.bytes_per_second)
+
+    def pause(self):
+        self.pause_clock()
+
+    def resume(self):
+        self.resume_clock()
+
+    def stop(self):
+        self.stopped = True
+
+
+def trim_cache(cache_dir: str, max_bytes: int):
+    # removes the least recently played PCM files until the rest fit into max_bytes, playing a
+    # file touches it
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".pcm"):
+            try:
+                stat = os.stat(path.join(cache_dir, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass  # already gone, e.g. trimmed by another player at the same time, its room is free all the same
+        except OSError:
+            continue
+        total -= size
+
+
+class StreamingMusic:
+    # Decodes the song with ffmpeg a chunk at a time, the pipe and the sink's one queued chunk are the
+    # only buffers, so memory stays flat. The first pass is also written to a raw PCM file in cache_dir,
+    # later loops (and later runs) play that file without decoding again. Once the cache holds more
+    # than cache_size bytes the least recently played files are removed.
+    # The sink is fed by a task on the event loop the frames are drawn on, only the reads from the pipe
+    # or the PCM file go to the loop's executor.
+    def __init__(self, song_name: str, sink, loops=1, interval=3, cache_dir=None, chunk_frames=4096,
+                 cache_size=1024 * 1024 * 1024):
+        self.song_name = song_name
+        self.sink = sink
         self.loops = loops
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.chunk_size = chunk_frames * 2 * sink.channels
+        self.decoder = None
+        self.stopped = Event()
+        self.resumed = Event()
+        self.resumed.set()
+        self.first_pass = None
+        self.opened = None  # the generator of the first pass
+        self.task = None
 
-    def run(self):
-        while self.loops >= 1:
-            play(self.audio)
-            self.loops -= 1
-            sleep(self.interval)
+    @property
+    def pcm_file(self):
+        if self.cache_dir is None:
+            return None
+        stat = os.stat(self.song_name)
+        key = "{}:{}:{}:{}:{}".format(path.abspath(self.song_name), stat.st_mtime, stat.st_size,
+                                      self.sink.frequency, self.sink.channels)
+        return path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pcm")
+
+    def decode(self):
+        command = [AudioSegment.converter, "-loglevel", "error", "-i", self.song_name,
+                   "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(self.sink.frequency),
+                   "-ac", str(self.sink.channels), "-"]
+        self.decoder = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        pcm_file = self.pcm_file
+        copy = None
+        if pcm_file is not None:
+            # a file of its own, the same song may be decoded twice at once, e.g. played while it is prefetched
+            os.makedirs(self.cache_dir, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(suffix=".tmp", prefix=path.basename(pcm_file), dir=self.cache_dir)
+            copy = os.fdopen(descriptor, "wb")
+        complete = False
+        try:
+            while not self.stopped.is_set():
+                chunk = self.decoder.stdout.read(self.chunk_size)
+                if not chunk:
+                    complete = self.decoder.wait() == 0
+                    break
+                if copy is not None:
+                    copy.write(chunk)
+                yield chunk
+        finally:
+            # a stopped or failed decode leaves no PCM file behind, the next run decodes again
+            if self.decoder.poll() is None:
+                self.decoder.kill()
+            self.decoder.stdout.close()
+            self.decoder.wait()
+            self.decoder = None
+            if copy is not None:
+                copy.close()
+                try:
+                    if complete:
+                        os.replace(temporary, pcm_file)
+                    else:
+                        os.remove(temporary)
+                except OSError:
+                    pass  # the cache was cleared meanwhile, the next run decodes again
+                if complete:
+                    trim_cache(self.cache_dir, self.cache_size)
+
+    def chunks(self):
+        pcm_file = self.pcm_file
+        try:
+            f = open(pcm_file, "rb") if pcm_file is not None else None
+        except OSError:
+            f = None
+        if f is None:
+            yield from self.decode()
+            return
+        with f:
+            os.utime(f.fileno())  # played last, trimmed last
+            while not self.stopped.is_set():
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def prefetch(self):
+        # starts the first pass and holds its first chunk, so feed() can start playing right away
+        chunks = self.opened = self.chunks()
+        first_chunk = next(chunks, None)
+        self.first_pass = itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+
+    async def feed(self):
+        loop = asyncio.get_running_loop()
+        loops = self.loops
+        if self.first_pass is None:
+            await loop.run_in_executor(None, self.prefetch)
+        stream = self.first_pass
+        while loops >= 1 and not self.stopped.is_set():
+            while not self.stopped.is_set():
+                chunk = await loop.run_in_executor(None, next, stream, None)
+                if chunk is None:
+                    break
+                while not self.resumed.is_set():
+                    await asyncio.sleep(0.01)
+                if self.stopped.is_set():
+                    break
+                await self.sink.write(chunk)
+            loops -= 1
+            if loops >= 1 and not self.stopped.is_set():
+                await asyncio.sleep(self.interval)
+                stream = self.chunks()
+
+    def start(self):
+        # needs the running event loop, the task feeds the sink until the song ends or stop()
+        self.task = asyncio.ensure_future(self.feed())
+
+    def pause(self):
+        self.resumed.clear()
+        self.sink.pause()
+
+    def resume(self):
+        self.sink.resume()
+        self.resumed.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.resumed.set()
+        self.sink.stop()
+        if self.task is not None:
+            self.task.cancel()
+        elif self.opened is not None:
+            # prefetched but never played, e.g. a song skipped over: the decoder is closed right away
+            # instead of once the generator is collected
+            self.opened.close()
 
 
 class BackgroundMusic:
-    def __init__(self, song_name: str, loops=1, interval=3, forever=True):
+    def __init__(self, song_name: str, loops=1, interval=3, forever=True, cache_dir=path.join(".cache", "audio"),
+                 cache_size=1024 * 1024 * 1024):
         self.song_name = song_name
+        self.cache_size = cache_size
         self.loops = loops
         if forever:
             self.loops = float("inf")
         self.interval = interval
         self.forever_flag = forever
+        self.cache_dir = cache_dir
+        self.stream = None
+        self.preparing = Lock()
+        self.clock = PlaybackClock()  # mixer.music's position on Windows
+
+    def preload(self):
+        # opens the stream ahead of run(), e.g. on a loader thread while the scene is being built
+        with self.preparing:
+            if platform.system() == "Linux" and self.stream is None:
+                try:
+                    sink = MixerSink()
+                except pygame.error:
+                    sink = NullSink()
+                self.stream = StreamingMusic(self.song_name, sink, loops=self.loops, interval=self.interval,
+                                             cache_dir=self.cache_dir, cache_size=self.cache_size)
+                self.stream.prefetch()
 
     def run(self):
         if platform.system() == "Windows":
             mixer.init()
             mixer.music.load(self.song_name)
             mixer.music.play(loops=self.loops)
+            self.clock.start_chunk(0.0)
 
         elif platform.system() == "Linux":
-            music = AudioSegment.from_file(self.song_name)
-            thread = LoopMusic(music, loops=self.loops, interval=self.interval)
-            thread.setDaemon(True)
-            thread.start()
+            self.preload()
+            self.stream.start()
+
+    def position(self) -> float:
+        # seconds since the song started, the clock the animation is locked to
+        if platform.system() == "Windows":
+            played = mixer.music.get_pos() if mixer.get_init() else -1
+            if played >= 0 and self.clock.paused_at is None:
+                self.clock.start_chunk(played / 1000)
+            return self.clock.position()
+        if self.stream is None:
+            return 0.0
+        return self.stream.sink.position()
+
+    def pause(self):
+        if platform.system() == "Windows":
+            self.clock.pause_clock()
+            mixer.music.pause()
+        elif self.stream is not None:
+            self.stream.pause()
+
+    def resume(self):
+        if platform.system() == "Windows":
+            mixer.music.unpause()
+            self.clock.resume_clock()
+        elif self.stream is not None:
+            self.stream.resume()
+
+    def stop(self):
+        if platform.system() == "Windows":
+            if mixer.get_init():
+                mixer.music.stop()
+        elif self.stream is not None:
+            self.stream.stop()
 
     def __enter__(self):
         self.run()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
+        self.stop()
@@ -0,0 +1,20 @@
+import importlib
+from sys import exit
+
+from engineUtils import main
+from exportUtils import parse_args
+
+# python play.py 十八年 清风歌: plays the songs one after the other on one engine,
+# python play.py --control .cache/play.sock --send "queue 清风歌" controls an instance that is playing
+if __name__ == "__main__":
+    options = parse_args()
+    if options.send is not None:
+        from playlistUtils import send
+        if options.control is None:
+            exit("--send needs the --control socket")
+        try:
+            print(send(options.control, options.send))
+        except OSError as e:
+            exit("no instance is listening on {}: {}".format(options.control, e))
+        exit(0)
+    main(*[importlib.import_module(name).SONG for name in options.songs])
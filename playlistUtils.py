@@ -0,0 +1,222 @@
+import asyncio
+import importlib
+import os
+import socket
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Optional
+
+import pygame
+
+from musicUtils import BackgroundMusic
+from poemUtils import Section
+from sceneUtils import Scene, Song, flush_line_cache
+
+
+def load_song(name: str) -> Song:
+    # songs are modules declaring a SONG, e.g. 十八年
+    return importlib.import_module(name).SONG
+
+
+async def control_server(address: str, playlist) -> asyncio.AbstractServer:
+    # a port number listens on localhost over TCP (there are no Unix sockets on older Windows),
+    # anything else is the path of a Unix socket. Connections are served on the event loop, between
+    # frames, one command per line and every command is answered with one line.
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8").strip()
+                if command:
+                    writer.write((playlist.command(command) + "\n").encode("utf-8"))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if address.isdigit():
+        return await asyncio.start_server(serve, "127.0.0.1", int(address), reuse_address=True)
+    if os.path.exists(address):
+        os.remove(address)  # left behind by an instance that was killed
+    if os.path.dirname(address):
+        os.makedirs(os.path.dirname(address), exist_ok=True)
+    return await asyncio.start_unix_server(serve, address)
+
+
+def send(address: str, command: str) -> str:
+    if address.isdigit():
+        connection = socket.create_connection(("127.0.0.1", int(address)))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    with connection, connection.makefile("rwb") as stream:
+        stream.write((command + "\n").encode("utf-8"))
+        stream.flush()
+        return stream.readline().decode("utf-8").strip()
+
+
+def stop_prepared(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        _, music = future.result()
+        music.stop()
+
+
+class Playlist:
+    # Plays songs back to back on one engine, the display, fonts and caches stay up between them.
+    # The scenes of the last `warm` songs are kept with their fonts and rendered rows, a song that
+    # comes up again only rewinds its scene. The next song's scene is built and its music starts
+    # decoding once the current song reaches its epilogue, so it starts right away. Songs are prepared
+    # one at a time on a thread of their own: a scene waits for the images, poems and audio it loads on
+    # the asset pool, and waiting on a worker of that pool could leave no worker to load them.
+    # With nothing left to play the END card stays up until a song is queued over the control socket.
+    # Everything runs on one event loop: the frames, the music, the control socket and the waits for
+    # the scenes being prepared are tasks, so commands apply between two frames.
+    def __init__(self, engine, songs: Iterable[Song], loop: bool = False, warm: int = 2,
+                 control: Optional[str] = None):
+        self.engine = engine
+        self.upcoming = deque(songs)
+        self.loop = loop
+        self.warm = max(1, warm)
+        self.control = control
+        self.scenes = OrderedDict()  # title -> Scene, the least recently played first
+        self.preparing = ThreadPoolExecutor(max_workers=1)
+        self.prefetched = None  # (song, future of its scene and music)
+        self.song = None
+        self.scene = None
+        self.music = None
+        self.paused = False
+        self.quitting = False
+
+    def command(self, text: str) -> str:
+        name, _, argument = text.partition(" ")
+        argument = argument.strip()
+        if name in ("queue", "next"):
+            try:
+                song = load_song(argument)
+            except Exception as e:
+                return "error {}: {}".format(argument, e)
+            self.apply(name, song)
+            return "ok"
+        if name in ("skip", "pause", "resume", "quit"):
+            self.apply(name, None)
+            return "ok"
+        if name == "status":
+            upcoming = [song.title for song in self.upcoming]
+            return "{} {}; upcoming: {}".format("paused" if self.paused else "playing",
+                                                self.song.title if self.song is not None else "-",
+                                                ", ".join(upcoming) or "-")
+        return "error unknown command {}, use queue/next NAME, skip, pause, resume, status or quit".format(name)
+
+    def apply(self, name: str, argument):
+        if name == "queue":
+            self.upcoming.append(argument)
+        elif name == "next":
+            self.upcoming.appendleft(argument)
+        elif name == "skip" and self.scene is not None:
+            # straight to the END card, which gives way to the next song if there is one
+            self.music.stop()
+            self.scene.seek(self.scene.length)
+        elif name == "pause" and self.music is not None and not self.paused:
+            # the animation follows the music's position, so it stands still with it
+            self.music.pause()
+            self.paused = True
+        elif name == "resume" and self.music is not None and self.paused:
+            self.music.resume()
+            self.paused = False
+        elif name == "quit":
+            # the song stops once the command is answered, see poll()
+            self.quitting = True
+
+    def prepare(self, song: Song):
+        # the music decodes while the scene is built or rewound, the warm scene is only looked up
+        # here since the song before may still be playing it
+        options = self.engine.options
+        music = BackgroundMusic(song.music, loops=1, forever=False, cache_size=options.audio_cache_size * 1024 * 1024)
+        decoded = self.engine.assets.load("music", music.preload)
+        scene = self.scenes.get(song.title)
+        if scene is None:
+            scene = Scene(self.engine, song, options.end_time, options.seed)
+            self.engine.assets.load("line cache", flush_line_cache, scene)
+        decoded.get()
+        return scene, music
+
+    def prefetch(self):
+        song = self.upcoming[0] if self.upcoming else None
+        # a song pushed in front of the one prefetched takes its place
+        if song is not None and (self.prefetched is None or self.prefetched[0] is not song):
+            self.discard()
+            self.prefetched = (song, self.preparing.submit(self.prepare, song))
+
+    def discard(self):
+        # a prefetched song that is not played after all: not prepared at all if it has not started,
+        # otherwise its decoder is closed once it is prepared
+        if self.prefetched is None:
+            return
+        _, future = self.prefetched
+        self.prefetched = None
+        if not future.cancel():
+            future.add_done_callback(stop_prepared)
+
+    async def take(self, song: Song):
+        # the scene is built (or found warm) on the preparing thread, the loop keeps serving the socket meanwhile
+        if self.prefetched is None or self.prefetched[0] is not song:
+            self.discard()
+            self.prefetched = (song, self.preparing.submit(self.prepare, song))
+        scene, music = await asyncio.wrap_future(self.prefetched[1])
+        self.prefetched = None
+        scene.rewind()
+        self.scenes[song.title] = scene
+        self.scenes.move_to_end(song.title)
+        while len(self.scenes) > self.warm:
+            self.scenes.popitem(last=False)
+        self.song, self.scene, self.music = song, scene, music
+        self.paused = False
+        return scene, music
+
+    def poll(self) -> bool:
+        # called every frame: prefetches once the epilogue begins and tells whether the current song goes on
+        if self.quitting:
+            return False
+        if self.scene.phase == Section.EPILOGUE:
+            self.prefetch()
+        return not self.scene.completed or not self.upcoming
+
+    def next_song(self) -> Song:
+        song = self.upcoming.popleft()
+        if self.loop:
+            self.upcoming.append(song)
+        return song
+
+    async def wait(self):
+        # nothing has been queued yet, only the control socket and quitting are served
+        self.engine.start()
+        while not self.upcoming and not self.quitting:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and
+                                                 event.key in (pygame.K_q, pygame.K_ESCAPE)):
+                    self.engine.quit()
+            await asyncio.sleep(0.05)
+
+    async def run(self):
+        server = None
+        if self.control is not None:
+            server = await control_server(self.control, self)
+        try:
+            if not self.upcoming:
+                await self.wait()
+            while not self.quitting:
+                song = self.next_song()
+                self.engine.start(song.window)
+                scene, music = await self.take(song)
+                await self.engine.play(scene, music, self.poll)
+        finally:
+            # the music of the song played stops as play() returns, a prefetched one is closed here
+            self.discard()
+            self.preparing.shutdown(wait=False)
+            if server is not None:
+                server.close()
+                if not self.control.isdigit() and os.path.exists(self.control):
+                    os.remove(self.control)
@@ -0,0 +1,521 @@
+import hashlib
+import math
+from enum import Enum
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+import numpy
+import pygame
+
+from cacheUtils import versions
+from effectUtils import LEVELS, Keyframes, column, column_extent, faded, glow as glowing
+from lyricsUtils import CueIndex, CueTimeline, load_cues
+from renderUtils import composite_tiles
+from timelineUtils import PoemState, PoemTimeline, Stage
+
+
+class Section(Enum):
+    PROLOGUE = 1
+    BODY = 2
+    EPILOGUE = 3
+
+
+class SnowflakeBackground:
+    # Flakes are kept as parallel numpy arrays instead of one object each, so moving,
+    # culling and spawning a whole frame of snow are a few array operations. The arrays have
+    # room for more flakes than are falling and are filled in place, x, y, sx, sy and r are views
+    # of the live flakes at their front. They only grow, by doubling, when the snow gets heavier.
+    def __init__(self, engine, fall_rate: float = 0.5, seed=None, capacity: int = 1024):
+        self.engine = engine
+        # a seeded background replays the same snow, so any frame can be rebuilt by stepping to it
+        self.seed = seed
+        self.random = numpy.random.RandomState(seed)
+        self.count = 0
+        self.buffers = self.allocate(capacity)
+        self.alive = numpy.empty(capacity, dtype=bool)
+        self.x = self.y = self.sx = self.sy = self.r = None  # x, y, x speed, y speed and radius
+        self.views()
+        self.fluctuation = 1
+        self.max_rate = 36
+        self.min_rate = -1.5 * self.fluctuation
+        self.fall_rate = fall_rate if fall_rate < self.max_rate else self.max_rate
+        self.active = True
+        # one pre-drawn sprite per radius, and the pixel offsets it covers around a flake's center
+        self.sprites = [None]
+        self.discs = [None]
+        for r in range(1, 5):
+            sprite = pygame.Surface((2 * r + 1, 2 * r + 1))
+            sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            pygame.draw.circle(sprite, (255, 255, 255), (r, r), r)
+            self.sprites.append(sprite)
+            dx, dy = numpy.nonzero(pygame.surfarray.array2d(sprite))
+            self.discs.append((dx - r, dy - r))
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def allocate(capacity: int):
+        # x, y, sx and sy in the rows of one array, r in another
+        return numpy.empty((4, capacity)), numpy.empty(capacity, dtype=int)
+
+    def views(self):
+        count = self.count
+        fields, radii = self.buffers
+        self.x, self.y, self.sx, self.sy = fields[:, :count]
+        self.r = radii[:count]
+
+    def generate_snowflakes(self):
+        new_snows = int(self.random.normal(self.fall_rate, self.fluctuation))
+        if new_snows <= 0:
+            return
+        count, end = self.count, self.count + new_snows
+        if end > len(self.alive):
+            capacity = max(end, 2 * len(self.alive))
+            buffers = self.allocate(capacity)
+            buffers[0][:, :count] = self.buffers[0][:, :count]
+            buffers[1][:count] = self.buffers[1][:count]
+            self.buffers = buffers
+            self.alive = numpy.empty(capacity, dtype=bool)
+        fields, radii = self.buffers
+        speed_unit = self.engine.speed_unit
+        fields[0, count:end] = self.random.randint(0, self.engine.width, new_snows)
+        fields[1, count:end] = -0.1 * self.engine.height
+        fields[2, count:end] = self.random.uniform(-1 * speed_unit, 1 * speed_unit, new_snows)
+        fields[3, count:end] = self.random.uniform(2 * speed_unit, 4 * speed_unit, new_snows)
+        radii[count:end] = self.random.randint(1, 5, new_snows)
+        self.count = end
+        self.views()
+
+    def fly(self):
+        self.x += self.sx
+        self.y += self.sy
+        count = self.count
+        alive = numpy.less_equal(self.y, self.engine.height, out=self.alive[:count])
+        if not alive.all():
+            # the flakes that melted in the front part make room for the live ones behind it, only
+            # the few that moved are copied. All flakes are white, the order they are drawn in is not seen.
+            fields, radii = self.buffers
+            kept = int(numpy.count_nonzero(alive))
+            holes = numpy.flatnonzero(alive[:kept] == 0)
+            movers = numpy.flatnonzero(alive[kept:]) + kept
+            fields[:, holes] = fields[:, movers]
+            radii[holes] = radii[movers]
+            self.count = kept
+            self.views()
+
+    def draw(self, surface: pygame.Surface):
+        cx = numpy.rint(self.x).astype(numpy.intp)
+        cy = numpy.rint(self.y).astype(numpy.intp)
+        if surface.get_bytesize() != 4:
+            sprites = self.sprites
+            surface.blits([(sprites[r], (x, y)) for r, x, y in
+                           zip(self.r.tolist(), (cx - self.r).tolist(), (cy - self.r).tolist())], False)
+            return
+        # write the discs straight into the pixel buffer, a few fancy-index assignments per frame
+        width, height = surface.get_size()
+        pitch = surface.get_pitch() // 4
+        color = surface.map_rgb((255, 255, 255))
+        pixels = numpy.frombuffer(surface.get_buffer(), dtype=numpy.uint32)
+        for r in range(1, len(self.discs)):
+            selected = self.r == r
+            dx, dy = self.discs[r]
+            xs = cx[selected][:, None] + dx
+            ys = cy[selected][:, None] + dy
+            inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+            pixels[ys[inside] * pitch + xs[inside]] = color
+        del pixels  # releases the surface lock
+
+    def update(self, draw: bool = True):
+        if self.active:
+            self.generate_snowflakes()
+            self.fly()
+            if draw:
+                self.show()
+
+    def show(self):
+        if self.active:
+            self.engine.renderer.draw(self.draw, self.dirty_rects())
+
+    def signature(self) -> Optional[bytes]:
+        # the flakes as draw() puts them on the screen, None when it draws nothing
+        if not self.active or not len(self):
+            return None
+        fields = (numpy.rint(self.x).astype(numpy.intp), numpy.rint(self.y).astype(numpy.intp), self.r)
+        return hashlib.blake2b(b"".join(field.tobytes() for field in fields), digest_size=16).digest()
+
+    def dirty_rects(self):
+        # past a few hundred flakes the snow covers most of the screen, it is cheaper to redraw all of it
+        if len(self) > 256:
+            return None
+        return [pygame.Rect(x - r, y - r, 2 * r + 1, 2 * r + 1) for x, y, r in
+                zip(numpy.rint(self.x).astype(int).tolist(), numpy.rint(self.y).astype(int).tolist(),
+                    self.r.tolist())]
+
+    def reset(self):
+        self.random.seed(self.seed)
+        self.count = 0
+        self.views()
+
+    def increase_snowflakes(self, rate: float = 0.5):
+        if self.fall_rate < self.max_rate:
+            self.fall_rate += rate + (self.fall_rate * 0.1)
+
+    def decrease_snowflakes(self, rate: float = 0.5):
+        if self.fall_rate > self.min_rate:
+            self.fall_rate -= rate + (self.fall_rate * 0.1)
+
+    def switch_visibility(self):
+        self.active = not self.active
+
+
+class Poem:
+    def __init__(self, engine, filename: str, font_src: str, font_size: int,
+                 line_space_coefficient: float = 1.0,
+                 bold: bool = False,
+                 color: Tuple[int, int, int] = (0, 0, 0), speed: float = 2.0, stay_time: float = 10.0,
+                 speed_change_rate: float = 1.0,
+                 boundary_left: int = 0,
+                 boundary_right: Optional[int] = None, hanging_height=-1, align="center-fit-right",
+                 left_margin: int = 0, composite: bool = False, streaming: bool = False, name: Optional[str] = None,
+                 rendered: Optional[Dict[tuple, pygame.Surface]] = None, track: int = 0, bilingual: bool = False,
+                 together: bool = False, fade: float = 0.0, glow: Optional[Tuple[int, int, int]] = None,
+                 glow_radius: int = 6,
+                 typewriter: bool = False, vertical: bool = False, unsung: float = 0.4):
+        # left_margin keeps left aligned rows off the left boundary, rendered holds rows another poem
+        # already rendered (see rendered_rows), e.g. the one this poem replaces after its file changed.
+        # A .lrc or .srt file is timed: its rows keep to the song's clock instead of speed and stay_time
+        # (the last LRC line is held for stay_time), track picks the line of a bilingual cue: the lines
+        # stamped alike in an LRC file, the lines of a subtitle in a bilingual SRT file. A poem
+        # played together plays at the same time as the poem before it in the song, e.g. its translation.
+        # The rows of a timed poem are drawn at unsung of their opacity while their cue is not showing,
+        # the rows being sung (several where subtitles overlap, none in a gap) in full.
+        # Effects: glow puts a halo of that color under the rows. fade fades them in and out over that
+        # fraction of the screen at its edges, typewriter reveals a row character by character as it
+        # rises into place (a timed row while its cue is sung). A vertical poem sets its rows
+        # top to bottom as columns that move from left to right, the first one rightmost, and its
+        # boundaries and alignment are the top and bottom of the band the columns hang in.
+        self.name = name or filename
+        self.together = together
+        self.version = next(versions)
+        self.style = (font_src, font_size, bold, color, vertical, glow, glow_radius)
+        self.reused = rendered or {}
+        self.renderer = engine.renderer
+        self.frame_rate = engine.frame_rate
+        # the screen's extent along which the rows move, its width for a vertical poem
+        self.screen_height = engine.width if vertical else engine.height
+        self.font_size = font_size
+        if composite and streaming:
+            raise ValueError("a streaming poem never holds all of its rows, it cannot be composited")
+        if composite and (fade or typewriter or vertical):
+            raise ValueError("a composited poem is drawn in tiles, its rows cannot fade, type or stand vertically")
+        self.fade = fade
+        self.glow = glow
+        self.bleed = glow_radius if glow is not None else 0  # how far the halo reaches past a row
+        self.typewriter = typewriter
+        self.vertical = vertical
+        # the rows are drawn with keyframes instead of as they were rendered
+        self.animated = bool(fade or typewriter or vertical)
+        self.keyframes = Keyframes()
+        # streamed rows come and go, they are not added to the line cache
+        self.font_over = engine.line_cache.font(font_src, font_size, store=not streaming)
+        self.font_over.set_bold(bold)
+        self.line_space = font_size * line_space_coefficient
+        self.start_pixel = self.screen_height
+        self.fall_speed = speed * engine.speed_unit
+        self.max_speed = 32
+        self.min_speed = 0.5
+        self.speed_change_rate = speed_change_rate
+        self.max_width = 0  # find the longest text width within a poem
+        self.row_height = font_size  # the tallest row rendered so far
+        self.stage = Stage.INITIALIZING
+        self.stay_time = self.frame_rate * stay_time
+        self.staying_time_left = self.stay_time
+        self.boundary_left = boundary_left
+        self.boundary_right = boundary_right if boundary_right is not None else (
+            engine.height if vertical else engine.width)
+        self.section_width = self.boundary_right - self.boundary_left
+        self.leaving_threshold = - 0.2 * self.screen_height
+        self.filename = filename
+        self.color = color
+        self.streaming = streaming
+        self.reader = None  # the open source file of a streaming poem
+        self.rows_read = 0
+        cues = load_cues(filename, stay_time, bilingual)
+        if cues is not None and streaming:
+            raise ValueError("a timed poem places every row by its cue, it cannot be streamed")
+        if cues is not None and not cues:
+            raise ValueError("{} has no timed lines".format(filename))
+        self.cues = CueIndex(cues) if cues is not None else None
+        self.sung = ()  # the indices of the cues showing, their rows are drawn in full
+        self.unsung = max(0, min(LEVELS, round(unsung * LEVELS)))
+        if self.cues is not None:
+            self.animated = self.animated or self.unsung < LEVELS
+            self.lyrics = [self.row(cue.lines[track] if track < len(cue.lines) else "", rank)
+                           for rank, cue in enumerate(self.cues.cues, start=1)]
+            self.lines_count = len(self.lyrics)
+        elif streaming:
+            # a pre-pass measures the rows without rendering them, they are read again as they come up
+            self.lyrics = []
+            self.lines_count = 0
+            with open(filename, "r", encoding="utf-8") as f:
+                for line in f:
+                    self.lines_count += 1
+                    self.max_width = max(self.max_width, self.measure(line.replace("\n", "")))
+        else:
+            with open(filename, "r", encoding="utf-8") as f:
+                self.lyrics = [self.row(line, index) for index, line in enumerate(f.readlines(), start=1)]
+            self.lines_count = len(self.lyrics)
+
+        right_align_start = self.boundary_right - self.max_width - self.line_space
+        center_align_start = self.boundary_left + (self.section_width - self.max_width) / 2
+        left_align_start = self.boundary_left + left_margin
+        if align == "center":
+            self.start_align = center_align_start
+        elif align == "right":
+            self.start_align = right_align_start
+        elif align == "left":
+            self.start_align = left_align_start
+        elif align == "center-fit-right":
+            self.start_align = right_align_start if right_align_start < center_align_start else center_align_start
+        elif align == "center-fit-left":
+            self.start_align = center_align_start if center_align_start > left_align_start else left_align_start
+
+        self.section_height = (self.lines_count - 1) * self.line_space + self.font_size
+        if hanging_height == -1:
+            if self.section_height > self.screen_height:
+                self.hanging_height = self.line_space
+            else:
+                self.hanging_height = (self.screen_height - self.section_height) / 2 + self.font_size
+        else:
+            self.hanging_height = hanging_height
+
+        self.freeze = False
+        # the last row decides the stages: it hangs once it rises above the screen's height - hanging_height
+        # and the poem completes once it rises above leaving_threshold
+        last_row_start = self.start_pixel + self.lines_count * self.line_space
+        if self.cues is not None:
+            # the row being sung is on the reading line, hanging_height above the bottom or mid-screen
+            reading = self.screen_height / 2 if hanging_height == -1 else self.screen_height - hanging_height
+            # a typed row is written out while its cue is sung, between its cue and the next
+            self.reveal = (reading, reading - self.line_space)
+            self.initial_timeline = CueTimeline(self.cues, self.frame_rate,
+                                                self.start_pixel + self.line_space - reading, self.line_space,
+                                                self.fall_speed, self.fall_speed * self.speed_change_rate,
+                                                last_row_start - self.leaving_threshold)
+        else:
+            # a typed row is written out as it rises from the bottom to the line the last row hangs at
+            self.reveal = (self.screen_height, self.screen_height - self.hanging_height)
+            self.initial_timeline = PoemTimeline(last_row_start - (self.screen_height - self.hanging_height),
+                                                 last_row_start - self.leaving_threshold, self.speed_change_rate,
+                                                 PoemState(Stage.ENTERING, 0, self.stay_time, self.fall_speed))
+        self.timeline = self.initial_timeline
+        self.start_time = None  # the second of the song the scene placed the poem at, see Scene.place
+        self.frame = 0  # frames the poem has been played for
+        self.offset = 0
+        # composite poems draw all rows once into a few screen-high tiles and blit those instead
+        self.layer = None
+        if composite:
+            self.layer = composite_tiles([(lyric.rendered, (lyric.rank - 1) * self.line_space)
+                                          for lyric in self.lyrics], self.max_width + 2 * self.bleed,
+                                         self.screen_height)
+        self.reused = {}
+        self.stage = Stage.ENTERING
+
+    def follow_cues(self, start_time: float):
+        # a timed poem that starts playing start_time seconds into the song
+        self.start_time = start_time
+        self.initial_timeline = self.initial_timeline.starting_at(start_time)
+        self.timeline = self.initial_timeline
+        self.seek(0)
+
+    def follow_beats(self, timing, start_time: float = 0.0, beats_per_row: float = 1.0):
+        # rows rise one every beats_per_row beats of the song and the first row comes up on the first
+        # beat after start_time, the second of the song at which the poem starts entering
+        self.start_time = start_time
+        speed = self.line_space / (timing.beat_period * beats_per_row * self.frame_rate)
+        # the first row's top reaches the bottom of the screen once the offset is one line_space
+        offset = self.line_space - (timing.next_beat(start_time) - start_time) * self.frame_rate * speed
+        self.fall_speed = speed
+        self.initial_timeline = PoemTimeline(self.initial_timeline.hanging_threshold,
+                                             self.initial_timeline.leaving_threshold, self.speed_change_rate,
+                                             PoemState(Stage.ENTERING, offset, self.stay_time, speed))
+        self.timeline = self.initial_timeline
+        self.seek(0)
+
+    def rendered_rows(self) -> Dict[tuple, pygame.Surface]:
+        return {(self.style, lyric.content): lyric.rendered for lyric in self.lyrics}
+
+    def set_speed(self, speed: float):
+        self.timeline = self.timeline.rebase(self.frame, speed)
+        self.fall_speed = speed
+
+    def increase_speed(self, coefficient=1.25):
+        new_speed = self.fall_speed * coefficient
+        if new_speed < self.max_speed:
+            self.set_speed(new_speed)
+
+    def decrease_speed(self, coefficient=1.25):
+        new_speed = self.fall_speed / coefficient
+        if new_speed > self.min_speed:
+            self.set_speed(new_speed)
+
+    def seek(self, frame: int):
+        # jumping before a speed change falls back to the poem's own speeds
+        if frame < self.timeline.start_frame:
+            self.timeline = self.initial_timeline
+        self.frame = frame
+        self.stage, self.offset, self.staying_time_left, self.fall_speed = self.timeline.state(frame)
+        if self.cues is not None:
+            self.sung = self.timeline.showing(frame)
+        if self.streaming:
+            self.stream_rows()
+
+    def stream_rows(self):
+        # keeps rendered only the rows between leaving_threshold and one row below the screen
+        first = max(1, math.floor((self.leaving_threshold + self.offset - self.start_pixel) / self.line_space) + 1)
+        bottom = self.screen_height + self.line_space
+        last = min(self.lines_count, math.ceil((bottom + self.offset - self.start_pixel) / self.line_space))
+        first_kept = self.lyrics[0].rank if self.lyrics else self.rows_read + 1
+        if first < first_kept:
+            # the rows needed have been dropped already, read the file again from the top
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+            self.rows_read = 0
+            self.lyrics = []
+        while self.lyrics and self.lyrics[0].rank < first:
+            self.lyrics.pop(0)
+        if self.reader is None and self.rows_read < last:
+            self.reader = open(self.filename, "r", encoding="utf-8")
+        while self.rows_read < last:
+            line = self.reader.readline()
+            self.rows_read += 1
+            if self.rows_read >= first:
+                self.lyrics.append(self.row(line, self.rows_read))
+        if self.reader is not None and self.rows_read >= self.lines_count:
+            self.reader.close()
+            self.reader = None
+
+    def seek_time(self, seconds: float):
+        self.seek(round(seconds * self.frame_rate))
+
+    def update(self, draw: bool = True) -> bool:
+        # True when the poem is on the screen this frame
+        if self.stage == Stage.REINITIALIZING:
+            self.timeline = self.initial_timeline
+            self.seek(0)
+        elif self.stage == Stage.ENTERING or self.stage == Stage.LEAVING or self.stage == Stage.STAYING:
+            # a frozen poem stops moving but still counts down its staying time
+            if self.stage == Stage.STAYING or not self.freeze:
+                self.seek(self.frame + 1)
+            if draw:
+                self.show()
+            return True
+        return False
+
+    def signature(self) -> tuple:
+        # everything show() draws follows from the rows, the offset and the cues being sung
+        return self.version, self.offset, self.sung
+
+    def show(self):
+        if self.layer is None:
+            # the rows are evenly spaced, the ones on the screen are sliced out instead of tested one by one
+            lyrics = self.lyrics
+            if not lyrics:
+                return
+            top = self.start_pixel - self.offset  # where a row of rank 0 would be
+            first = max(0, math.floor((-self.row_height - top) / self.line_space) - lyrics[0].rank)
+            last = math.ceil((self.screen_height - top) / self.line_space) + 1 - lyrics[0].rank
+            start, line_space, offset = self.start_pixel, self.line_space, self.offset
+            if self.animated:
+                placed = (self.placed(lyric, start + lyric.rank * line_space - offset)
+                          for lyric in lyrics[first:max(first, last)])
+                self.renderer.blits([blit for blit in placed if blit is not None])
+                return
+            # a halo reaches bleed past the row on every side
+            x, start = self.start_align - self.bleed, start - self.bleed
+            self.renderer.blits([(lyric.rendered, (x, start + lyric.rank * line_space - offset))
+                                 for lyric in lyrics[first:max(first, last)]])
+            return
+        top = self.start_pixel + self.line_space - self.offset - self.bleed  # where the first row is on the screen
+        for index, tile in enumerate(self.layer):
+            y = top + index * self.screen_height
+            if -tile.get_height() < y < self.screen_height:
+                self.renderer.blit(tile, (self.start_align - self.bleed, y))
+
+    def placed(self, lyric: "Poem.PoemRow", along: float) -> Optional[Tuple[pygame.Surface, Tuple[float, float]]]:
+        # The row, along the way the rows move, as its effects draw it there: faded by how close it is to
+        # the screen's edges, dimmed while its cue is not sung and typed out as far as it has risen, in a
+        # few steps each. The keyframe of every step is built once, nothing is rendered again. None for a
+        # row that is not to be seen.
+        rendered, bleed = lyric.rendered, self.bleed
+        length = (rendered.get_width() if self.vertical else rendered.get_height()) - 2 * bleed
+        level = LEVELS
+        if self.fade:
+            edge = min(self.screen_height - along, along + length)
+            level = min(LEVELS, math.floor(edge / (self.fade * self.screen_height) * LEVELS))
+        if self.cues is not None and lyric.rank - 1 not in self.sung:
+            level = min(level, self.unsung)
+        if level <= 0:
+            return None
+        typed = None  # the characters shown, None for all of them
+        if self.typewriter:
+            count = len(lyric.content.replace("\n", ""))
+            start, end = self.reveal
+            typed = min(count, math.floor((start - along) / (start - end) * count)) if start > end else count
+            if typed <= 0 < count:
+                return None
+            if typed >= count:
+                typed = None
+        if level < LEVELS or typed is not None:
+            rendered = self.keyframes.get((lyric.rank, level, typed), partial(self.keyframe, lyric, level, typed))
+        if self.vertical:
+            return rendered, (self.screen_height - along - length - bleed, self.start_align - bleed)
+        return rendered, (self.start_align - bleed, along - bleed)
+
+    def keyframe(self, lyric: "Poem.PoemRow", level: int, typed: Optional[int]) -> pygame.Surface:
+        surface = lyric.rendered
+        if typed is not None:
+            # the rendered row cut after its first characters, a subsurface shares the row's pixels
+            shown = lyric.content.replace("\n", "")[:typed]
+            width, height = surface.get_size()
+            if self.vertical:
+                surface = surface.subsurface((0, 0, width, min(height, self.bleed + self.measure(shown))))
+            else:
+                surface = surface.subsurface((0, 0, min(width, self.bleed + self.measure(shown)), height))
+        return faded(surface, level) if level < LEVELS else surface
+
+    def measure(self, text: str) -> int:
+        # how far text reaches across the way the rows move
+        if self.vertical:
+            return column_extent(self.font_over, text, self.font_size)
+        return self.font_over.size(text)[0]
+
+    def row(self, line: str, rank: int) -> "Poem.PoemRow":
+        rendered = self.reused.get((self.style, line))
+        if rendered is None:
+            text = line.replace("\n", "")
+            if self.vertical:
+                rendered = column(self.font_over, text, self.color, self.font_size)
+            else:
+                rendered = self.font_over.render(text, True, self.color)
+            if self.glow is not None:
+                rendered = glowing(rendered, self.glow, self.bleed)
+        # the sizes of the row itself, without its halo
+        across, along = rendered.get_width() - 2 * self.bleed, rendered.get_height() - 2 * self.bleed
+        if self.vertical:
+            across, along = along, across
+        self.max_width = max(self.max_width, across)
+        self.row_height = max(self.row_height, along)
+        return self.PoemRow(line, rank, rendered)
+
+    class PoemRow:
+        # A code scroll holds thousands of rows, so a row is only its text, rank (from 1) and surface.
+        # Where it is follows from the poem's offset, nothing is stored or updated per row and frame.
+        __slots__ = ("content", "rank", "rendered")
+
+        def __init__(self, content: str, rank: int, rendered: pygame.Surface):
+            self.content = content
+            self.rank = rank
+            self.rendered = rendered
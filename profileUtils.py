@@ -0,0 +1,144 @@
+import atexit
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Tuple
+
+import pygame
+
+untimed = nullcontext()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FrameProfiler:
+    # Times the parts of every frame (event handling, background, snow, each poem, presenting) with
+    # perf_counter. The last `window` frames feed the HUD: fps, p50/p99 frame times, the particle
+    # count and the average of every part. With a trace file every frame and part is also written
+    # in Chrome's trace event format, which chrome://tracing and ui.perfetto.dev load.
+    def __init__(self, enabled: bool = True, hud: bool = False, trace: Optional[str] = None, window: int = 240):
+        self.enabled = enabled or trace is not None
+        self.show_hud = hud
+        self.start = time.perf_counter()
+        self.frame_started = None
+        self.spans = []  # type: List[Tuple[str, float, float]]
+        self.frame_times = deque(maxlen=window)
+        self.section_times = {}  # type: Dict[str, deque]
+        self.window = window
+        self.frames = 0
+        self.particles = None
+        self.hud_surface = None
+        self.hud_drawn_at = 0.0
+        self.font = None
+        self.trace = None
+        if trace is not None:
+            self.trace = open(trace, "w", encoding="utf-8")
+            self.trace.write("[")
+            self.separator = "\n"
+            self.pid = os.getpid()
+            atexit.register(self.close)
+
+    def section(self, name: str):
+        if not self.enabled:
+            return untimed
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, started, time.perf_counter()))
+
+    def end_frame(self, particles: Optional[int] = None, skipped: int = 0):
+        # called once a frame has been presented, the frame runs from the previous call to this one
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        started = self.frame_started
+        if started is None:
+            # the first frame starts with its own work, not with the loading before it
+            started = self.spans[0][1] if self.spans else now
+        self.frame_started = now
+        self.frames += 1
+        self.particles = particles
+        self.frame_times.append(now - started)
+        totals = {}
+        for name, begin, end in self.spans:
+            totals[name] = totals.get(name, 0.0) + end - begin
+        for name, total in totals.items():
+            self.section_times.setdefault(name, deque(maxlen=self.window)).append(total)
+        if self.trace is not None:
+            self.write_trace(started, now, particles, skipped)
+        self.spans = []
+
+    def write_trace(self, started: float, now: float, particles: Optional[int], skipped: int):
+        def event(name, begin, end, **extra):
+            fields = {"name": name, "ph": "X", "pid": self.pid, "tid": 0,
+                      "ts": round((begin - self.start) * 1e6, 1), "dur": round((end - begin) * 1e6, 1)}
+            fields.update(extra)
+            return json.dumps(fields, ensure_ascii=False)
+
+        events = [event("frame", started, now, args={"frame": self.frames, "skipped": skipped})]
+        events += [event(name, begin, end) for name, begin, end in self.spans]
+        if particles is not None:
+            events.append(json.dumps({"name": "particles", "ph": "C", "pid": self.pid,
+                                      "ts": round((now - self.start) * 1e6, 1), "args": {"particles": particles}}))
+        self.trace.write(self.separator + ",\n".join(events))
+        self.separator = ",\n"
+
+    def toggle_hud(self):
+        self.show_hud = not self.show_hud
+
+    def lines(self) -> List[Tuple[str, str]]:
+        # (label, value) pairs, the summary line has no value
+        if not self.frame_times:
+            return []
+        average = sum(self.frame_times) / len(self.frame_times)
+        summary = "fps {:.1f}  p50 {:.1f} ms  p99 {:.1f} ms".format(
+            1 / average if average > 0 else 0.0, percentile(self.frame_times, 0.5) * 1000,
+            percentile(self.frame_times, 0.99) * 1000)
+        if self.particles is not None:
+            summary += "  particles {}".format(self.particles)
+        return [(summary, "")] + [(name, "{:.2f} ms".format(sum(times) / len(times) * 1000))
+                                  for name, times in sorted(self.section_times.items())]
+
+    def hud(self, renderer):
+        # the text is redrawn four times a second, rendering it every frame would show up in the numbers
+        if not self.show_hud or not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.hud_surface is None or now - self.hud_drawn_at > 0.25:
+            self.hud_drawn_at = now
+            if self.font is None:
+                self.font = pygame.font.Font(None, 22)
+            rendered = [(self.font.render(label, True, (255, 255, 0)), self.font.render(value, True, (255, 255, 0)))
+                        for label, value in self.lines()]
+            if not rendered:
+                return
+            width = max(max(label.get_width() for label, _ in rendered),
+                        max(label.get_width() + value.get_width() for label, value in rendered[1:]) + 24
+                        if len(rendered) > 1 else 0) + 12
+            height = sum(label.get_height() for label, _ in rendered) + 12
+            self.hud_surface = pygame.Surface((width, height))
+            self.hud_surface.fill((0, 0, 0))
+            y = 6
+            for label, value in rendered:
+                self.hud_surface.blit(label, (6, y))
+                self.hud_surface.blit(value, (width - 6 - value.get_width(), y))
+                y += label.get_height()
+            self.hud_surface.set_alpha(200)
+        renderer.blit(self.hud_surface, (8, 8))
+
+    def close(self):
+        if self.trace is not None:
+            # the viewers also load a trace cut off without its closing bracket, e.g. after a crash
+            self.trace.write("\n]\n")
+            self.trace.close()
+            self.trace = None
@@ -0,0 +1,73 @@
+import os
+import runpy
+import sys
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from sceneUtils import Scene, Song
+
+
+def song_file(song: Song) -> Optional[str]:
+    # the file declaring the song, also when it runs as __main__
+    for module in list(sys.modules.values()):
+        if getattr(module, "SONG", None) is song:
+            return getattr(module, "__file__", None)
+    return None
+
+
+def stamp(filename: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None  # an editor replacing the file, it is looked at again on the next poll
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Watcher:
+    # --watch: a few times a second the lyric files of the playing scene and the song's own file are
+    # checked for changes. Changed lyrics rebuild their poems, a changed song file is run again and its
+    # poems, background and snow are compared with the playing ones. Only the rows whose text changed
+    # are rendered, the scene keeps its frame, and the display, fonts and music are never restarted.
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.checked = 0.0
+        self.scene = None
+        self.config = None  # the song's file, a reloaded song is no module's SONG any more
+        self.stamps = {}  # type: Dict[str, Optional[Tuple[int, int]]]
+
+    def files(self):
+        files = {spec.filename for spec in self.scene.song.body + self.scene.song.epilogue}
+        if self.config is not None:
+            files.add(self.config)
+        return files
+
+    def poll(self, scene: Scene):
+        now = time.perf_counter()
+        if now - self.checked < self.interval:
+            return
+        self.checked = now
+        if scene is not self.scene:
+            # the first poll, or the next song of a playlist
+            self.scene = scene
+            self.config = song_file(scene.song)
+            self.stamps = {filename: stamp(filename) for filename in self.files()}
+            return
+        stamps = {filename: stamp(filename) for filename in self.stamps}
+        changed = {filename for filename, known in self.stamps.items() if stamps[filename] != known}
+        if not changed:
+            return
+        self.stamps = stamps
+        started = time.perf_counter()
+        try:
+            song = runpy.run_path(self.config)["SONG"] if self.config in changed else scene.song
+            scene.reload(song, changed)
+        except Exception:
+            # e.g. a song file saved half-way through an edit, the scene plays on as it was
+            traceback.print_exc()
+            return
+        # lyric files the new song added are watched from now on
+        for filename in self.files() - set(self.stamps):
+            self.stamps[filename] = stamp(filename)
+        scene.engine.line_cache.flush()
+        print("reloaded {} in {:.0f} ms".format(", ".join(sorted(changed)), (time.perf_counter() - started) * 1000))
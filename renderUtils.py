@@ -0,0 +1,141 @@
+import math
+from typing import Callable, List, Optional, Tuple
+
+import pygame
+
+
+class FrameRenderer:
+    # draws straight onto the surface and presents the whole frame every time
+    def __init__(self, surface: pygame.Surface):
+        self.surface = surface
+
+    def set_surface(self, surface: pygame.Surface):
+        self.surface = surface
+
+    def set_background(self, background: pygame.Surface):
+        self.surface.blit(background, (0, 0))
+
+    def paint_background(self, painter: Callable[[pygame.Surface], None]):
+        # a background drawn anew every frame, e.g. a moving one, painted straight onto the frame
+        painter(self.surface)
+
+    def blit(self, source: pygame.Surface, position):
+        self.surface.blit(source, position)
+
+    def blits(self, blits: List[Tuple[pygame.Surface, Tuple[float, float]]]):
+        self.surface.blits(blits, False)
+
+    def draw(self, painter: Callable[[pygame.Surface], None], rects: Optional[List[pygame.Rect]] = None):
+        # painter draws on its own, rects are the areas it touches (None for anywhere on the frame)
+        painter(self.surface)
+
+    def present(self):
+        pygame.display.flip()
+
+
+class DirtyRectRenderer(FrameRenderer):
+    # Keeps the draw calls of a frame and compares them with the previous frame's.
+    # Only the areas that changed are restored from the background, redrawn and passed
+    # to display.update, and a frame identical to the last one is not presented at all.
+    def __init__(self, surface: pygame.Surface):
+        super(DirtyRectRenderer, self).__init__(surface)
+        self.background = None
+        self.operations = []  # (source, position) for blits, (painter, rects) for painters
+        self.painted = False
+        self.previous_operations = None
+        self.previous_rects = []
+        self.full_redraw = True
+
+    def set_surface(self, surface: pygame.Surface):
+        self.surface = surface
+        self.full_redraw = True
+
+    def set_background(self, background: pygame.Surface):
+        if background is not self.background:
+            self.background = background
+            self.full_redraw = True
+
+    def paint_background(self, painter: Callable[[pygame.Surface], None]):
+        # a painted background changes every frame, there is nothing to restore areas from
+        self.background = painter
+        self.full_redraw = True
+
+    def blit(self, source: pygame.Surface, position):
+        self.operations.append((source, position))
+
+    def blits(self, blits: List[Tuple[pygame.Surface, Tuple[float, float]]]):
+        self.operations.extend(blits)
+
+    def draw(self, painter: Callable[[pygame.Surface], None], rects: Optional[List[pygame.Rect]] = None):
+        self.operations.append((painter, rects))
+        self.painted = True
+
+    def present(self):
+        operations, painted = self.operations, self.painted
+        self.operations, self.painted = [], False
+        # a frame with painters is never treated as static
+        if not self.full_redraw and not painted and operations == self.previous_operations:
+            return
+
+        screen_rect = self.surface.get_rect()
+        visible = []
+        rects = []
+        painted_anywhere = False
+        for operation in operations:
+            if callable(operation[0]):
+                visible.append(operation)
+                if operation[1] is None:
+                    painted_anywhere = True
+                else:
+                    rects.extend(operation[1])
+                continue
+            source, (x, y) = operation
+            rect = screen_rect.clip(pygame.Rect((int(x), int(y)), source.get_size()))
+            if rect.width and rect.height:
+                visible.append(operation)
+                rects.append(rect)
+
+        full_redraw = self.full_redraw or painted_anywhere
+        if full_redraw:
+            if callable(self.background):
+                self.background(self.surface)
+            else:
+                self.surface.blit(self.background, (0, 0))
+        else:
+            for rect in self.previous_rects:
+                self.surface.blit(self.background, rect, rect)
+        for operation in visible:
+            if callable(operation[0]):
+                operation[0](self.surface)
+            else:
+                self.surface.blit(*operation)
+
+        if full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.previous_rects + rects)
+        self.previous_operations = None if painted else operations
+        self.previous_rects = rects
+        # paint that could be anywhere is only wiped by redrawing the whole next frame
+        self.full_redraw = painted_anywhere
+
+
+def composite_tiles(rows: List[Tuple[pygame.Surface, float]], width: int, tile_height: int) -> List[pygame.Surface]:
+    # Draws rows (surface, y inside the layer) once onto transparent tiles tile_height high, so a
+    # layer scrolling through a window of that height takes one or two blits per frame.
+    # BLEND_RGBA_MAX copies each row's pixels and alpha as they are, blending them onto the
+    # transparent tile would darken the anti-aliased edges.
+    if not rows:
+        return []
+    height = max(int(y) + row.get_height() for row, y in rows)
+    tiles = [pygame.Surface((max(1, math.ceil(width)), min(tile_height, height - top)), pygame.SRCALPHA)
+             for top in range(0, height, tile_height)]
+    for row, y in rows:
+        # only the tiles the row overlaps, a row taller than the gap to a tile's bottom spills into the next
+        y = int(y)
+        for index in range(y // tile_height, (y + row.get_height() - 1) // tile_height + 1):
+            tiles[index].blit(row, (0, y - index * tile_height), special_flags=pygame.BLEND_RGBA_MAX)
+    for tile in tiles:
+        # the tiles never change again, run-length encoding lets blits skip the transparent runs
+        tile.set_alpha(255, pygame.RLEACCEL)
+    return tiles
@@ -0,0 +1,313 @@
+import math
+from os import path
+from typing import List, NamedTuple, Optional, Tuple
+
+import pygame
+
+from backgroundUtils import MOTIONS, Background, Motion
+from cacheUtils import versions
+from poemUtils import Poem, Section, SnowflakeBackground
+from timelineUtils import Stage
+
+src_dir = "src"
+
+
+class PoemSpec(NamedTuple):
+    # One poem of a song. settings are Poem's keyword arguments, except that boundary_left and
+    # boundary_right are fractions of the screen's width (its height for a vertical poem) so a song
+    # plays at any size.
+    name: str
+    filename: str
+    font: str
+    font_size: int
+    settings: dict
+
+    def build(self, engine, rendered=None) -> Poem:
+        settings = dict(self.settings)
+        for boundary in ("boundary_left", "boundary_right"):
+            if boundary in settings:
+                settings[boundary] = (engine.height if settings.get("vertical") else engine.width) * settings[boundary]
+        return Poem(engine, self.filename, self.font, self.font_size, name=self.name, rendered=rendered, **settings)
+
+
+def poem(name: str, filename: str, font: str, font_size: int, **settings) -> PoemSpec:
+    return PoemSpec(name, filename, font, font_size, settings)
+
+
+def groups(poems: List[Poem]) -> List[List[Poem]]:
+    # the poems that play at the same time: one after the other, except that a poem built with
+    # together=True plays along with the one before it
+    grouped = []
+    for poem in poems:
+        if poem.together and grouped:
+            grouped[-1].append(poem)
+        else:
+            grouped.append([poem])
+    return grouped
+
+
+def group_length(group: List[Poem]) -> int:
+    return max(poem.initial_timeline.length for poem in group)
+
+
+class Song(NamedTuple):
+    # A song as data: its files and poems. The body plays over the background, one poem after the
+    # other (or together, see Poem), then the epilogue on black and the END card.
+    title: str
+    music: str
+    background: str
+    body: Tuple[PoemSpec, ...]
+    epilogue: Tuple[PoemSpec, ...]
+    end_font: str = path.join(src_dir, "Calafia-Regular.otf")
+    background_fit: str = "cover"  # or "stretch" to fill the screen whatever its proportions
+    motion: Optional[Motion] = None  # a slow pan across the background, --background-motion overrides it
+    snow: Optional[float] = None  # the snow's fall rate, None for a song without snow
+    follow_beats: Tuple[str, ...] = ()  # the body poems paced by the song's beats with --follow-beats
+    window: Optional[Tuple[int, int]] = None  # on Windows a resizable window of this size instead of fullscreen
+
+
+class Scene:
+    def __init__(self, engine, song: Song, end_time: float = 3.0, seed=None):
+        # the background and poems are loaded on the asset pool, the first frame only waits for
+        # the body and the epilogue is waited for once it begins
+        self.engine = engine
+        self.song = song
+        options = engine.options
+        assets = engine.assets
+        timing = None
+        if options.follow_beats and song.follow_beats:
+            from analysisUtils import timing_index  # NumPy's analysis and pydub only load when asked for
+            timing = assets.load("timing", timing_index, options.audio or song.music)
+        # convert() needs the display mode to be set before the image is queued
+        background = assets.load("background", self.load_background, song)
+        body = [assets.load(spec.name, spec.build, engine) for spec in song.body]
+        self.loading_epilogue = [assets.load(spec.name, spec.build, engine) for spec in song.epilogue]
+        self.epilogue_poems = None
+        self.seed = seed
+        self.version = next(versions)
+        self.snowflake_background = None
+        if song.snow is not None:
+            self.snowflake_background = SnowflakeBackground(engine, song.snow, seed=seed)
+        self.background = background.get()
+        self.body = [asset.get() for asset in body]
+        self.finale_background = None
+        font_over = engine.line_cache.font(song.end_font, 128)
+        self.thank_you = font_over.render("END", 1, (255, 255, 255))
+        self.end_time = end_time
+        self.end_frames_left = engine.frame_rate * end_time
+        self.current_captions = self.body[0]
+        self.phase = Section.BODY
+        self.frame = 0  # frames played, the moving background follows them
+        self.timing = timing.get() if timing is not None else None
+        self.place()
+
+    def load_background(self, song: Song) -> Background:
+        engine = self.engine
+        motion = song.motion
+        if engine.options.background_motion is not None:
+            motion = MOTIONS.get(engine.options.background_motion)
+        return Background(engine.assets, song.background, engine.size, song.background_fit, motion,
+                          engine.output_sizes())
+
+    def poem(self, name: str) -> Poem:
+        return next(poem for poem in self.body + self.epilogue if poem.name == name)
+
+    @property
+    def epilogue(self):
+        if self.epilogue_poems is None:
+            self.epilogue_poems = [asset.get() for asset in self.loading_epilogue]
+            self.place_poems(self.epilogue_poems, self.body_length / self.engine.frame_rate)
+        return self.epilogue_poems
+
+    def reload(self, song: Song, changed_files=()):
+        # --watch: rebuilds the poems whose spec changed or whose file is among changed_files, rows
+        # with the same text and style keep their surfaces. Only the poems rebuilt, or moved to another
+        # start by them, jump to the scene's frame, the others keep their state and speed. The snow
+        # stays as it is, new snow starts falling from here instead of being replayed from the start.
+        poems = {poem.name: poem for poem in self.body + self.epilogue}
+        specs = {spec.name: spec for spec in self.song.body + self.song.epilogue}
+
+        def rebuilt(spec: PoemSpec) -> Poem:
+            poem = poems.get(spec.name)
+            beats = (spec.name in song.follow_beats) == (spec.name in self.song.follow_beats)
+            if poem is not None and specs.get(spec.name) == spec and spec.filename not in changed_files and beats:
+                return poem
+            return spec.build(self.engine, poem.rendered_rows() if poem is not None else None)
+
+        self.body = [rebuilt(spec) for spec in song.body]
+        self.epilogue_poems = [rebuilt(spec) for spec in song.epilogue]
+        if (song.background, song.background_fit, song.motion) != (self.song.background, self.song.background_fit,
+                                                                   self.song.motion):
+            self.background = self.load_background(song)
+        if song.snow is None:
+            self.snowflake_background = None
+        elif self.snowflake_background is None or song.snow != self.song.snow:
+            self.snowflake_background = SnowflakeBackground(self.engine, song.snow, seed=self.seed)
+        self.song = song
+        kept = {poem: poem.initial_timeline for poem in poems.values()}
+        self.place()
+        frames_left = self.frame
+        for section in (self.body, self.epilogue):
+            for group in groups(section):
+                for poem in group:
+                    if kept.get(poem) is not poem.initial_timeline:
+                        poem.timeline = poem.initial_timeline
+                        poem.seek(frames_left)
+                frames_left = max(0, frames_left - group_length(group))
+            frames_left = max(0, frames_left - 1)  # the frame on which the body notices it is done
+
+    def wait_loaded(self):
+        for asset in self.loading_epilogue:
+            asset.get()
+
+    def place(self):
+        # the epilogue starts the frame after the body, it is placed once it has loaded
+        self.place_poems(self.body, 0.0)
+        if self.epilogue_poems is not None:
+            self.place_poems(self.epilogue_poems, self.body_length / self.engine.frame_rate)
+
+    def place_poems(self, poems: List[Poem], start_time: float):
+        # every group starts where the one before it ended: timed poems keep to the song's clock from
+        # there on, with --follow-beats the song's poems come up one after the other on the beats
+        for group in groups(poems):
+            for poem in group:
+                # a poem already placed at its start keeps its timeline, e.g. one a reload left as it was
+                if poem.start_time == start_time:
+                    continue
+                if poem.cues is not None:
+                    poem.follow_cues(start_time)
+                elif self.timing is not None and poem.name in self.song.follow_beats:
+                    poem.follow_beats(self.timing, start_time, self.engine.options.beats_per_row)
+            start_time += group_length(group) / self.engine.frame_rate
+
+    @property
+    def completed(self):
+        return self.end_frames_left <= 0
+
+    @property
+    def body_length(self):
+        # one extra frame at the end, the one on which the body notices its poems are done
+        return sum(group_length(group) for group in groups(self.body)) + 1
+
+    @property
+    def length(self):
+        return (self.body_length + sum(group_length(group) for group in groups(self.epilogue)) +
+                math.ceil(self.engine.frame_rate * self.end_time))
+
+    def rewind(self):
+        # a scene the playlist kept warm plays again from the start, without the hotkeys' freezing
+        for poem in self.body + self.epilogue:
+            poem.freeze = False
+        self.seek(0)
+
+    def seek(self, frame: int):
+        # the poems jump straight to their frame, only the snow has to be replayed
+        self.current_captions = self.body[0]
+        if self.snowflake_background is not None:
+            self.snowflake_background.reset()
+            for _ in range(min(frame, self.body_length)):
+                self.snowflake_background.update(draw=False)
+        self.end_frames_left = self.engine.frame_rate * self.end_time
+        self.frame = frame
+        frames_left = frame
+        self.phase = Section.BODY
+        # the poems after the frame are rewound as well, a scene may be played again
+        for poems in (self.body, self.epilogue):
+            for group in groups(poems):
+                for poem in group:
+                    poem.timeline = poem.initial_timeline
+                    poem.seek(frames_left)
+                if frames_left > 0:
+                    self.current_captions = group[0]
+                frames_left = max(0, frames_left - group_length(group))
+            if self.phase == Section.BODY and frames_left > 0:
+                frames_left -= 1
+                self.phase = Section.EPILOGUE
+        self.end_frames_left -= frames_left
+
+    def update(self, draw: bool = True):
+        # draw=False only advances the timeline, used to fast-forward a scene to a frame
+        self.frame += 1
+        shown = self.advance()
+        if not draw:
+            return
+        cache, surface = self.engine.frame_cache, self.engine.renderer.surface
+        if cache is None:
+            self.draw(*shown)
+            return
+        with self.engine.profiler.section("frame cache"):
+            key = self.signature(*shown)
+            if cache.restore(key, surface):
+                return
+        self.draw(*shown)
+        with self.engine.profiler.section("frame cache"):
+            cache.store(key, surface)
+
+    def advance(self) -> Tuple[Section, List[Poem], bool]:
+        # moves everything on by a frame and tells what the frame shows: its section, the poems on the
+        # screen and whether the END card is
+        profiler = self.engine.profiler
+        section = self.phase
+        if section == Section.BODY and self.snowflake_background is not None:
+            with profiler.section("snow"):
+                self.snowflake_background.update(draw=False)
+        playing = next(([poem for poem in group if poem.stage != Stage.COMPLETED]
+                        for group in groups(self.body if section == Section.BODY else self.epilogue)
+                        if any(poem.stage != Stage.COMPLETED for poem in group)), None)
+        if playing is not None:
+            self.current_captions = playing[0]
+            shown = []
+            for poem in playing:
+                with profiler.section(poem.name):
+                    if poem.update(draw=False):
+                        shown.append(poem)
+            return section, shown, False
+        if section == Section.BODY:
+            self.phase = Section.EPILOGUE
+            return section, [], False
+        self.end_frames_left -= 1
+        return section, [], True
+
+    def signature(self, section: Section, poems: List[Poem], end_card: bool) -> Optional[tuple]:
+        # the frame cache's key of the frame, None for one that is not to be cached
+        size = self.engine.size
+        shown = tuple(poem.signature() for poem in poems)
+        if section == Section.BODY:
+            background = self.background.signature(size, self.frame / self.engine.frame_rate)
+            if background is None:
+                return None
+            snow = self.snowflake_background.signature() if self.snowflake_background is not None else None
+            return self.version, section, background, snow, shown
+        return self.version, section, size, shown, end_card
+
+    def draw(self, section: Section, poems: List[Poem], end_card: bool):
+        renderer, profiler = self.engine.renderer, self.engine.profiler
+        with profiler.section("background"):
+            if section == Section.BODY:
+                self.background.draw(renderer, self.engine.size, self.frame / self.engine.frame_rate)
+            else:
+                renderer.set_background(self.finale())
+        if section == Section.BODY and self.snowflake_background is not None:
+            with profiler.section("snow"):
+                self.snowflake_background.show()
+        for poem in poems:
+            with profiler.section(poem.name):
+                poem.show()
+        if end_card:
+            font_size = 60
+            score_text_length = self.thank_you.get_width()
+            renderer.blit(self.thank_you, ((self.engine.width - score_text_length) / 2,
+                                           self.engine.height / 2 - 0.5 * font_size))
+
+    def finale(self) -> pygame.Surface:
+        # black at the screen's size, which changes when the window is resized
+        if self.finale_background is None or self.finale_background.get_size() != self.engine.size:
+            self.finale_background = pygame.Surface(self.engine.size)
+            self.finale_background.fill((0, 0, 0))
+        return self.finale_background
+
+
+def flush_line_cache(scene: Scene):
+    # the epilogue's poems may still be loading, their lines are written once they are built
+    scene.wait_loaded()
+    scene.engine.line_cache.flush()
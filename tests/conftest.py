@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live at the top of the repository, the tests need no display or sound device
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
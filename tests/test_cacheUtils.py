@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+
+import pygame
+
+from cacheUtils import PIXEL_FORMAT, FrameCache, LineCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def line(color, size=(20, 10)):
+    surface = pygame.Surface(size, pygame.SRCALPHA)
+    surface.fill(color)
+    return surface
+
+
+def pixels(surface):
+    return pygame.image.tostring(surface, PIXEL_FORMAT)
+
+
+def test_line_cache_reads_appended_lines_after_flush(tmp_path):
+    cache = LineCache(str(tmp_path))
+    cache.put("a", line((255, 0, 0, 255)))
+    cache.flush()
+    cache.put("b", line((0, 255, 0, 255)))
+    cache.flush()
+    # b lies past the end of the pack as it was mapped after the first flush
+    assert pixels(cache.get("b")) == pixels(line((0, 255, 0, 255)))
+    assert pixels(cache.get("a")) == pixels(line((255, 0, 0, 255)))
+
+
+def test_line_cache_reads_moved_lines_after_eviction(tmp_path):
+    size = 20 * 10 * 4
+    cache = LineCache(str(tmp_path), max_bytes=2 * size)
+    colors = {"a": (255, 0, 0, 255), "b": (0, 255, 0, 255), "c": (0, 0, 255, 255)}
+    cache.put("a", line(colors["a"]))
+    cache.put("b", line(colors["b"]))
+    cache.flush()
+    first = cache.get("a")
+    cache.index["a"][3] = 0  # least recently used
+    cache.put("c", line(colors["c"]))
+    cache.flush()
+    # the rewrite keeps b and c, b moves to the front of the pack
+    assert cache.get("a") is None
+    assert pixels(cache.get("b")) == pixels(line(colors["b"]))
+    assert pixels(cache.get("c")) == pixels(line(colors["c"]))
+    # a line handed out before the rewrite keeps its pixels
+    assert pixels(first) == pixels(line(colors["a"]))
+
+
+def test_line_cache_survives_a_restart(tmp_path):
+    cache = LineCache(str(tmp_path))
+    cache.put("a", line((10, 20, 30, 255)))
+    cache.flush()
+    cache.put("b", line((40, 50, 60, 255), (7, 3)))
+    cache.flush()
+    reloaded = LineCache(str(tmp_path))
+    assert pixels(reloaded.get("a")) == pixels(line((10, 20, 30, 255)))
+    assert reloaded.get("b").get_size() == (7, 3)
+
+
+def test_line_cache_put_while_flushing(tmp_path):
+    # poems put their lines on the asset pool while another thread flushes
+    import threading
+    cache = LineCache(str(tmp_path))
+    done = threading.Event()
+
+    def put_lines():
+        for index in range(2000):
+            cache.put(str(index), line((index % 256, 0, 0, 255), (4, 4)))
+        done.set()
+
+    thread = threading.Thread(target=put_lines)
+    thread.start()
+    while not done.is_set():
+        cache.flush()
+    thread.join()
+    cache.flush()
+    assert all(cache.get(str(index)) is not None for index in range(2000))
+
+
+def frame(color, size=(16, 9)):
+    surface = pygame.Surface(size)
+    surface.fill(color)
+    return surface
+
+
+def test_frame_cache_keeps_frames_shown_twice(tmp_path):
+    for directory in (None, str(tmp_path)):
+        cache = FrameCache(1024 * 1024, directory)
+        screen = frame((0, 0, 0))
+        for _ in range(2):
+            assert not cache.restore("red", screen)
+            screen.fill((255, 0, 0))
+            cache.store("red", screen)
+            cache.touched()
+        screen.fill((0, 0, 0))
+        assert cache.restore("red", screen)
+        assert pixels(screen) == pixels(frame((255, 0, 0)))
+
+
+def test_frame_cache_forgets_the_screen_it_replaced():
+    # F11 into a window of the same size: the key is the one shown last, but the new surface is black
+    cache = FrameCache(1024 * 1024)
+    screen = frame((0, 0, 0))
+    for _ in range(2):
+        cache.restore("red", screen)
+        screen.fill((255, 0, 0))
+        cache.store("red", screen)
+    screen = frame((0, 0, 0))
+    cache.reset()
+    # drawn again instead of taken for the frame still on the screen
+    assert not cache.restore("red", screen)
+
+
+def export(output, *options):
+    subprocess.run([sys.executable, "清风歌.py", "--export", str(output), "--size", "160x90", "--line-cache", "",
+                    "--seed", "1", "--end-time", "4"] + list(options), cwd=ROOT, check=True, capture_output=True)
+    with open(output, "rb") as f:
+        return f.read()
+
+
+def test_frame_cache_signatures_tell_frames_apart(tmp_path):
+    # a frame copied back is the frame that would have been drawn, in memory and in a mapped file alike
+    drawn = export(tmp_path / "drawn.raw")
+    assert export(tmp_path / "memory.raw", "--frame-cache-size", "16") == drawn
+    assert export(tmp_path / "mapped.raw", "--frame-cache-size", "16", "--frame-cache-dir", str(tmp_path)) == drawn
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+
+import pygame
+
+from engineUtils import Engine
+from exportUtils import parse_args
+from timelineUtils import FrameScheduler
+
+
+def test_a_slow_plain_hotkey_does_not_hold_up_the_loop():
+    engine = Engine(parse_args(["--headless", "--size", "160x90", "--line-cache", ""]))
+    applied = []
+
+    def slow(engine, scene):
+        time.sleep(0.3)
+        # the result is applied on the loop's thread
+        return lambda: applied.append(threading.current_thread())
+
+    async def press():
+        engine.keys[pygame.K_x] = slow
+        engine.handle(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_x, unicode="x", mod=0), None)
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        waited = time.perf_counter() - started
+        await asyncio.gather(*engine.hotkeys)
+        return waited
+
+    assert asyncio.run(press()) < 0.1
+    assert applied == [threading.main_thread()]
+
+
+def test_scheduler_sleeps_instead_of_spinning():
+    clock = time.perf_counter
+    started = clock()
+    scheduler = FrameScheduler(60, lambda: clock() - started)
+
+    async def frames():
+        cpu = time.process_time()
+        for _ in range(30):
+            scheduler.due()
+            await scheduler.wait()
+        return time.process_time() - cpu
+
+    cpu = asyncio.run(frames())
+    # half a second of frames for a few milliseconds of CPU, spinning took one for every frame
+    assert clock() - started > 0.4
+    assert cpu < 0.01
@@ -0,0 +1,13 @@
+import subprocess
+
+from exportUtils import VideoExporter, concat_chunks
+
+
+def test_soundtrack_ends_with_the_frames(tmp_path, monkeypatch):
+    exporter = VideoExporter(str(tmp_path / "song.mp4"), (160, 90), 30, audio="song.mp3")
+    assert "-shortest" in exporter.command()
+    commands = []
+    monkeypatch.setattr(subprocess, "run", lambda command, check: commands.append(command))
+    concat_chunks([str(tmp_path / "chunk-0000.mp4")], str(tmp_path / "song.mp4"), audio="song.mp3")
+    assert "-shortest" in commands[0]
+    assert commands[0].index("-shortest") < commands[0].index(str(tmp_path / "song.mp4"))
@@ -0,0 +1,109 @@
+from os import path
+
+import pytest
+
+from lyricsUtils import CueIndex, load_cues, parse_lrc, parse_srt
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+SRT = """1
+00:00:02,000 --> 00:00:03,500
+<i>第一行</i>
+First line
+
+2
+00:01:03,25 --> 00:01:05,000
+{\\an8}第二行
+"""
+
+
+def test_lrc_stamps_and_offset():
+    cues = parse_lrc("[ti:song]\n[offset:+500]\n[00:02.50]一\n[00:04.00]二\n", hold=3)
+    assert [(cue.start, cue.end, cue.lines) for cue in cues] == [(2.0, 3.5, ("一",)), (3.5, 6.5, ("二",))]
+
+
+def test_lrc_line_with_several_stamps():
+    cues = parse_lrc("[00:01.00][00:05.00]副歌\n[00:03:00]主歌\n")
+    assert [(cue.start, cue.lines) for cue in cues] == [(1.0, ("副歌",)), (3.0, ("主歌",)), (5.0, ("副歌",))]
+
+
+def test_lrc_lines_stamped_alike_are_one_bilingual_cue():
+    cues = parse_lrc("[00:01.00]原文\n[00:01.00]translation\n")
+    assert cues[0].lines == ("原文", "translation")
+
+
+def test_srt_wrapped_lines_are_one_row():
+    cues = parse_srt(SRT)
+    assert [(cue.start, cue.end, cue.lines) for cue in cues] == [(2.0, 3.5, ("第一行 First line",)),
+                                                                 (63.25, 65.0, ("第二行",))]
+
+
+def test_srt_bilingual_lines_are_tracks():
+    cues = parse_srt(SRT.replace("\n", "\r\n"), bilingual=True)
+    assert [cue.lines for cue in cues] == [("第一行", "First line"), ("第二行",)]
+
+
+def test_load_cues_by_extension(tmp_path):
+    lyrics = tmp_path / "song.srt"
+    lyrics.write_text(SRT, encoding="utf-8-sig")
+    assert load_cues(str(lyrics))[0].lines == ("第一行 First line",)
+    assert load_cues(str(lyrics), bilingual=True)[0].lines == ("第一行", "First line")
+    assert load_cues(path.join(ROOT, "src", "清风歌.txt")) is None
+
+
+def test_cue_index_position():
+    index = CueIndex(parse_lrc("[00:04.00]二\n[00:02.00]一\n[00:08.00]三\n"))
+    assert [index.position(seconds) for seconds in (0, 2, 3, 4, 6, 20)] == [0.0, 0.0, 0.5, 1.0, 1.5, 2.0]
+
+
+def test_cue_index_showing_overlaps_and_gaps():
+    # a long cue under two short ones, then a gap before the last
+    index = CueIndex(parse_srt("""1
+00:00:01,000 --> 00:00:06,000
+long
+
+2
+00:00:02,000 --> 00:00:03,000
+short
+
+3
+00:00:04,000 --> 00:00:05,000
+overlapping
+
+4
+00:00:08,000 --> 00:00:09,000
+after the gap
+"""))
+    assert [index.showing(seconds) for seconds in (0, 1, 2.5, 3.5, 4.5, 6, 7, 8.5, 9)] == [
+        (), (0,), (0, 1), (0,), (0, 2), (), (), (3,), ()]
+
+
+def test_timed_epilogue_keeps_to_the_song(tmp_path):
+    import pygame
+    from exportUtils import parse_args
+    from engineUtils import Engine
+    from sceneUtils import Scene, Song, poem
+
+    lyrics = tmp_path / "epilogue.lrc"
+    lyrics.write_text("[01:00.00]一\n[01:02.00]二\n", encoding="utf-8")
+    font = path.join(ROOT, "src", "my_font.ttf")
+    song = Song(title="timed epilogue", music=path.join(ROOT, "src", "沧海一声笑剪辑后.mp3"),
+                background=path.join(ROOT, "src", "bg.jpg"),
+                body=(poem("body", path.join(ROOT, "src", "author清风歌.txt"), font, 20, speed=16, stay_time=0),),
+                epilogue=(poem("epilogue", str(lyrics), font, 20),))
+    engine = Engine(parse_args(["--headless", "--size", "160x90", "--line-cache", "", "--fps", "30"])).start()
+    try:
+        scene = Scene(engine, song, 1.0, 0)
+        timed = scene.poem("epilogue")
+        assert scene.body_length < 60 * 30
+        # the first row is on the reading line the moment its cue starts, counted from the start of the song
+        scene.seek(60 * 30 - 1)
+        assert timed.sung == ()
+        scene.seek(60 * 30)
+        assert scene.phase.name == "EPILOGUE"
+        assert timed.offset == pytest.approx(timed.timeline.reading_offset)
+        assert timed.sung == (0,)
+        scene.seek(61 * 30)
+        assert timed.offset == pytest.approx(timed.timeline.reading_offset + timed.line_space / 2)
+    finally:
+        pygame.quit()
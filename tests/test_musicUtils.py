@@ -0,0 +1,126 @@
+import os
+import stat
+import sys
+
+import pytest
+
+import musicUtils
+from musicUtils import NullSink, StreamingMusic, trim_cache
+
+PCM = bytes(range(256)) * 1024
+
+
+@pytest.fixture
+def converter(tmp_path, monkeypatch):
+    # stands in for ffmpeg: writes the same PCM whatever it is asked to decode
+    script = tmp_path / "ffmpeg"
+    script.write_text("#!{}\nimport sys\nfor start in range(0, {}, 4096):\n"
+                      "    sys.stdout.buffer.write(bytes(range(256)) * 16)\n"
+                      "    sys.stdout.buffer.flush()\n".format(sys.executable, len(PCM)))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(musicUtils.AudioSegment, "converter", str(script))
+    return script
+
+
+def song(tmp_path, name="song.mp3"):
+    filename = tmp_path / name
+    filename.write_bytes(name.encode("utf-8"))
+    return str(filename)
+
+
+def stream(filename, cache_dir, **settings):
+    return StreamingMusic(filename, NullSink(), cache_dir=cache_dir, chunk_frames=1024, **settings)
+
+
+def test_overlapping_decodes_of_one_song(tmp_path, converter):
+    cache_dir = str(tmp_path / "audio")
+    filename = song(tmp_path)
+    first, second = stream(filename, cache_dir).chunks(), stream(filename, cache_dir).chunks()
+    played = [b"", b""]
+    for chunks in zip(first, second):
+        played = [played[0] + chunks[0], played[1] + chunks[1]]
+    played[0] += b"".join(first)
+    played[1] += b"".join(second)
+    assert played == [PCM, PCM]
+    names = os.listdir(cache_dir)
+    assert len(names) == 1 and names[0].endswith(".pcm")
+    with open(os.path.join(cache_dir, names[0]), "rb") as f:
+        assert f.read() == PCM
+
+
+def test_stopped_decode_leaves_nothing_behind(tmp_path, converter):
+    cache_dir = str(tmp_path / "audio")
+    music = stream(song(tmp_path), cache_dir)
+    chunks = music.chunks()
+    next(chunks)
+    music.stopped.set()
+    assert b"".join(chunks) == b""
+    assert os.listdir(cache_dir) == []
+
+
+def test_second_play_reads_the_cache(tmp_path, converter, monkeypatch):
+    cache_dir = str(tmp_path / "audio")
+    filename = song(tmp_path)
+    assert b"".join(stream(filename, cache_dir).chunks()) == PCM
+    monkeypatch.setattr(musicUtils.AudioSegment, "converter", str(tmp_path / "missing"))
+    assert b"".join(stream(filename, cache_dir).chunks()) == PCM
+
+
+def test_cache_keeps_the_recently_played_songs(tmp_path, converter):
+    cache_dir = str(tmp_path / "audio")
+    songs = [stream(song(tmp_path, name), cache_dir, cache_size=2 * len(PCM)) for name in ("a.mp3", "b.mp3")]
+    for age, music in zip((1, 2), songs):
+        b"".join(music.chunks())
+        os.utime(music.pcm_file, (age, age))
+    # a was played before b, but played again it is b that is played least recently
+    b"".join(songs[0].chunks())
+    c = stream(song(tmp_path, "c.mp3"), cache_dir, cache_size=2 * len(PCM))
+    b"".join(c.chunks())
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(music.pcm_file) for music in (songs[0], c))
+
+
+def cached(cache_dir, names):
+    # PCM files played one after the other, the first one least recently
+    os.makedirs(cache_dir, exist_ok=True)
+    for age, name in enumerate(names, start=1):
+        filename = os.path.join(cache_dir, name)
+        with open(filename, "wb") as f:
+            f.write(PCM)
+        os.utime(filename, (age, age))
+
+
+def test_trim_cache_removes_the_least_recently_played(tmp_path):
+    cache_dir = str(tmp_path / "audio")
+    cached(cache_dir, ["b.pcm", "a.pcm", "c.pcm"])
+    with open(os.path.join(cache_dir, "other.tmp"), "wb") as f:
+        f.write(PCM)
+    trim_cache(cache_dir, len(PCM))
+    # a decode still being written is not the cache's to trim
+    assert sorted(os.listdir(cache_dir)) == ["c.pcm", "other.tmp"]
+
+
+def test_trim_cache_skips_a_file_already_removed(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "audio")
+    cached(cache_dir, ["a.pcm", "b.pcm", "c.pcm"])
+    remove = os.remove
+
+    def trimmed_meanwhile(filename):
+        # another player removes the file first
+        remove(filename)
+        raise FileNotFoundError(filename)
+
+    monkeypatch.setattr(os, "remove", trimmed_meanwhile)
+    trim_cache(cache_dir, 2 * len(PCM))
+    assert sorted(os.listdir(cache_dir)) == ["b.pcm", "c.pcm"]
+
+
+def test_stopping_a_prefetched_song_closes_its_decoder(tmp_path, converter):
+    # a song prefetched by the playlist and then skipped over is never played
+    cache_dir = str(tmp_path / "audio")
+    music = stream(song(tmp_path), cache_dir)
+    music.prefetch()
+    decoder = music.decoder
+    assert decoder is not None
+    music.stop()
+    assert music.decoder is None and decoder.poll() is not None
+    assert os.listdir(cache_dir) == []
@@ -0,0 +1,57 @@
+import shutil
+from os import path
+
+import numpy
+import pygame
+import pytest
+
+from engineUtils import Engine
+from exportUtils import parse_args
+from sceneUtils import Scene, Song, poem
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+@pytest.fixture
+def engine():
+    engine = Engine(parse_args(["--headless", "--size", "320x180", "--line-cache", "", "--fps", "60"])).start()
+    yield engine
+    pygame.quit()
+
+
+def song(lyrics, translation):
+    font = path.join(ROOT, "src", "my_font.ttf")
+    return Song(title="reload", music=path.join(ROOT, "src", "沧海一声笑剪辑后.mp3"),
+                background=path.join(ROOT, "src", "bg.jpg"),
+                body=(poem("lyrics", lyrics, font, 20, speed=0.5, stay_time=0, boundary_left=0.5),
+                      poem("translation", translation, font, 16, speed=0.5, stay_time=0, together=True)),
+                epilogue=(), snow=36)
+
+
+def test_reload_keeps_the_snow_and_the_poems_left_as_they_were(tmp_path, engine):
+    lyrics, translation = str(tmp_path / "lyrics.txt"), str(tmp_path / "translation.txt")
+    shutil.copy(path.join(ROOT, "src", "十八年.txt"), lyrics)
+    shutil.copy(path.join(ROOT, "src", "eighteen-years-lyrics.txt"), translation)
+    scene = Scene(engine, song(lyrics, translation), seed=1)
+    scene.seek(3000)
+    kept = scene.poem("lyrics")
+    kept.increase_speed()
+    for _ in range(10):
+        scene.update(draw=False)
+    snow = scene.snowflake_background
+    flakes = snow.x.copy()
+    speed, offset = kept.fall_speed, kept.offset
+
+    with open(translation, "a", encoding="utf-8") as f:
+        f.write("one more line\n")
+    scene.reload(song(lyrics, translation), {translation})
+
+    # the snow is not replayed from the start and the poem that did not change keeps its faster pace
+    assert scene.snowflake_background is snow
+    assert numpy.array_equal(snow.x, flakes)
+    assert scene.poem("lyrics") is kept
+    assert (kept.fall_speed, kept.offset) == (speed, offset)
+    # the rebuilt poem is where a poem played from the start would be
+    rebuilt = scene.poem("translation")
+    assert rebuilt.frame == 3010
+    assert rebuilt.lines_count == sum(1 for _ in open(translation, encoding="utf-8"))
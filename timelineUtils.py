@@ -0,0 +1,112 @@
+import asyncio
+import math
+from enum import Enum
+from typing import Callable, NamedTuple
+
+
+class Stage(Enum):
+    INITIALIZING = 0
+    ENTERING = 1
+    STAYING = 2
+    LEAVING = 3
+    COMPLETED = 4
+    REINITIALIZING = 5
+
+
+class PoemState(NamedTuple):
+    stage: Stage
+    offset: float  # how far every row has moved up from its starting position
+    staying_time_left: float
+    speed: float
+
+
+def frames_to_pass(offset: float, speed: float, threshold: float) -> float:
+    # the number of moves k >= 1 after which offset + k * speed > threshold,
+    # matched against the same float expression the timeline uses for the offset
+    if speed <= 0:
+        return math.inf
+    k = max(1, math.floor((threshold - offset) / speed) + 1)
+    while k > 1 and offset + (k - 1) * speed > threshold:
+        k -= 1
+    while not offset + k * speed > threshold:
+        k += 1
+    return k
+
+
+class PoemTimeline:
+    # All rows of a poem move together, so the whole animation is one offset per frame.
+    # The offsets of every stage are closed form, which lets a poem jump to any frame
+    # instead of stepping through the frames before it.
+    def __init__(self, hanging_threshold: float, leaving_threshold: float, speed_change_rate: float,
+                 anchor: PoemState, start_frame: int = 0):
+        self.hanging_threshold = hanging_threshold  # past this offset the last row hangs on the screen
+        self.leaving_threshold = leaving_threshold  # past this offset the last row has left the screen
+        self.speed_change_rate = speed_change_rate
+        self.anchor = anchor
+        self.start_frame = start_frame
+
+        stage, offset, staying_time_left, speed = anchor
+        self.entering_frames = 0
+        self.staying_frames = 0
+        self.leaving_frames = 0
+        self.hanging_offset = offset
+        self.leaving_speed = speed
+        if stage == Stage.ENTERING:
+            self.entering_frames = frames_to_pass(offset, speed, hanging_threshold)
+            if self.entering_frames != math.inf:
+                self.hanging_offset = offset + self.entering_frames * speed
+            self.leaving_speed = speed * speed_change_rate
+        if stage == Stage.ENTERING or stage == Stage.STAYING:
+            self.staying_frames = max(1, math.ceil(staying_time_left))
+        if stage != Stage.COMPLETED:
+            self.leaving_frames = frames_to_pass(self.hanging_offset, self.leaving_speed, leaving_threshold)
+        self.length = self.entering_frames + self.staying_frames + self.leaving_frames
+
+    def state(self, frame: int) -> PoemState:
+        # the state after `frame` updates, frames are counted from the poem's first entering frame
+        elapsed = frame - self.start_frame
+        stage, offset, staying_time_left, speed = self.anchor
+        if elapsed <= 0:
+            return self.anchor
+        if elapsed < self.entering_frames:
+            return PoemState(Stage.ENTERING, offset + elapsed * speed, staying_time_left, speed)
+        elapsed -= self.entering_frames
+        if elapsed < self.staying_frames:
+            return PoemState(Stage.STAYING, self.hanging_offset, staying_time_left - elapsed, self.leaving_speed)
+        staying_time_left -= self.staying_frames
+        elapsed -= self.staying_frames
+        if elapsed < self.leaving_frames:
+            return PoemState(Stage.LEAVING, self.hanging_offset + elapsed * self.leaving_speed, staying_time_left,
+                             self.leaving_speed)
+        return PoemState(Stage.COMPLETED, self.hanging_offset + self.leaving_frames * self.leaving_speed,
+                         staying_time_left, self.leaving_speed)
+
+    def rebase(self, frame: int, speed: float) -> "PoemTimeline":
+        # continue from the state at `frame` with another speed, e.g. after a speed hotkey
+        stage, offset, staying_time_left, _ = self.state(frame)
+        return PoemTimeline(self.hanging_threshold, self.leaving_threshold, self.speed_change_rate,
+                            PoemState(stage, offset, staying_time_left, speed), frame)
+
+
+class FrameScheduler:
+    # Locks the timeline to a clock in seconds, normally the song's playback position. due() tells how
+    # many timeline frames the clock has moved on since the last call: more than one when the machine
+    # fell behind (all but the last are advanced without drawing), none when it is ahead of the clock.
+    def __init__(self, frame_rate: int, clock: Callable[[], float]):
+        self.frame_rate = frame_rate
+        self.clock = clock
+        self.frame = 0  # timeline frames handed out so far
+
+    def due(self) -> int:
+        # frame k (counted from 1) is due once the clock reaches (k - 1) / frame_rate
+        frames = max(0, math.floor(self.clock() * self.frame_rate) + 1 - self.frame)
+        self.frame += frames
+        return frames
+
+    async def wait(self):
+        # sleeps on the event loop until the next frame is due, at most one frame long so events keep
+        # being handled while the clock stands still, e.g. when the music is paused. One sleep, no spinning:
+        # a timer that fires a little late only delays the frame, due() catches up with the clock.
+        # A late frame still yields once, so the music and the control socket are never starved.
+        delay = min(self.frame / self.frame_rate - self.clock(), 1 / self.frame_rate)
+        await asyncio.sleep(max(0.0, delay))